@@ -1,30 +1,116 @@
 import os
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+import threading
+import weakref
 from dotenv import load_dotenv
-import json
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import re
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
 import joblib
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+try:
+    import faiss  # Optional: accelerates /api/suggest when installed (pip install faiss-cpu)
+except ImportError:
+    faiss = None
+try:
+    import redis  # Optional: shares a taste-profile cache between workers when REDIS_URL is set (pip install redis)
+except ImportError:
+    redis = None
+from json_utils import orjson, dumps_json, loads_json
 
 # --- 1. SETUP ---
 load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+class OrjsonProvider(DefaultJSONProvider):
+    # Same sorted-key output as Flask's default provider; orjson writes bytes directly and handles numpy scalars.
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.option), mimetype=self.mimetype)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+def get_base_title(title):
+    return title.split(':')[0].split(' Season')[0].strip()
+
+YOUTUBE_ID_RE = re.compile(r"(?:v=|\/)([a-zA-Z0-9_-]{11})")
+
+def get_youtube_id_from_url(url):
+    if not isinstance(url, str): return None
+    match = YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
 # --- 2. MODEL & ASSET LOADING ---
 try:
     print("Loading model and data assets...")
     model = joblib.load('best_model.pkl')
     anime_df = pd.read_pickle('anime_dataframe.pkl')
     feature_matrix = np.load('anime_feature_matrix.npy')
+    # Rows are normalised once here so cosine similarity is a single dot product per request.
+    row_norms = np.linalg.norm(feature_matrix, axis=1, keepdims=True)
+    row_norms[row_norms == 0] = 1
+    feature_matrix_norm = (feature_matrix / row_norms).astype(np.float32)
+    if faiss is not None:
+        # Inner product over unit rows is cosine similarity; the flat index does exact SIMD top-k.
+        SIMILARITY_INDEX = faiss.IndexFlatIP(feature_matrix_norm.shape[1])
+        SIMILARITY_INDEX.add(feature_matrix_norm)
+    else:
+        SIMILARITY_INDEX = None
     id_to_index = pd.Series(anime_df.index, index=anime_df['anime_id']).to_dict()
+    # Row dicts built once; indexed by the same positions as id_to_index. Shared across requests, so read-only.
+    ANIME_RECORDS = anime_df.to_dict('records')
     ALL_GENRES = anime_df['genre_list'].explode().dropna().unique().tolist()
     EXPLICIT_GENRES_SET = {'Ecchi', 'Erotica', 'Hentai'}
+    # Lowercased once for /api/search_genres; explicit genres are never offered as suggestions.
+    SEARCHABLE_GENRES = [(genre.lower(), genre) for genre in ALL_GENRES if genre not in EXPLICIT_GENRES_SET]
+    # Every substring of every searchable genre mapped to its first five matches, so autocomplete is one dict lookup.
+    GENRE_AUTOCOMPLETE = {}
+    for genre_lc, genre in SEARCHABLE_GENRES:
+        for fragment in {genre_lc[i:j] for i in range(len(genre_lc)) for j in range(i + 1, len(genre_lc) + 1)}:
+            matches = GENRE_AUTOCOMPLETE.setdefault(fragment, [])
+            if len(matches) < 5: matches.append(genre)
+    # Precomputed boolean masks so candidate filtering is vectorised.
+    GENRE_INDEX = {genre: i for i, genre in enumerate(ALL_GENRES)}
+    GENRE_MATRIX = np.zeros((len(anime_df), len(ALL_GENRES)), dtype=bool)
+    for row, genres in enumerate(anime_df['genre_list']):
+        if isinstance(genres, list):
+            GENRE_MATRIX[row, [GENRE_INDEX[g] for g in genres]] = True
+    IS_EXPLICIT = GENRE_MATRIX[:, [GENRE_INDEX[g] for g in EXPLICIT_GENRES_SET if g in GENRE_INDEX]].any(axis=1)
+    HAS_PROMO = (anime_df['promo_link'].notna() & (anime_df['promo_link'] != '')).to_numpy()
+    PROMO_POOL_IDX = np.flatnonzero(HAS_PROMO)
+    # Trailer ids are extracted once per row at startup, so responses only look them up.
+    TRAILER_IDS = [get_youtube_id_from_url(url) for url in anime_df['promo_link'].tolist()]
+    # Integer studio codes per row (-1 for missing) so studio preferences become an array gather.
+    STUDIO_CODES, STUDIO_NAMES = pd.factorize(anime_df['studio'])
+    TITLE_TO_ID = dict(zip(anime_df['title'].tolist(), anime_df['anime_id'].tolist()))
+    TITLE_EN_TO_ID = {t: i for t, i in zip(anime_df['title_english'].tolist(), anime_df['anime_id'].tolist()) if isinstance(t, str)}
+    # Sorted (lowercase title, anime_id) pairs answer the franchise "title ILIKE 'base%'" lookup with a bisect.
+    TITLE_PREFIX_INDEX = sorted(
+        (t.lower(), i) for col in ('title', 'title_english')
+        for t, i in zip(anime_df[col].tolist(), anime_df['anime_id'].tolist()) if isinstance(t, str) and t)
+    TITLE_PREFIX_KEYS = [t for t, _ in TITLE_PREFIX_INDEX]
+    ID_TO_BASE_TITLE = {
+        anime_id: get_base_title(title_english or title).lower()
+        for anime_id, title, title_english in zip(anime_df['anime_id'].tolist(), anime_df['title'].tolist(), anime_df['title_english'].tolist())
+        if isinstance(title_english or title, str)}
     print("✅ Model and core assets loaded successfully.")
     ASSETS_LOADED = True
 except FileNotFoundError as e:
@@ -35,30 +121,145 @@ except Exception as e:
     ASSETS_LOADED = False
 
 # --- 3. DATABASE CONNECTION & HELPERS ---
+DB_POOL = None
+DB_POOL_LOCK = threading.Lock()
+# jsonb values (taste_profile) are decoded by the same parser the API uses; writes go through Json(), see to_jsonb().
+psycopg2.extras.register_default_jsonb(globally=True, loads=loads_json)
+
+def to_jsonb(obj):
+    return psycopg2.extras.Json(obj, dumps=dumps_json)
+
+def get_db_dsn():
+    ssl_mode = os.getenv('DB_SSLMODE', 'require')
+    return (f"dbname='{os.getenv('DB_NAME')}' user='{os.getenv('DB_USER')}' "
+            f"password='{os.getenv('DB_PASSWORD')}' host='{os.getenv('DB_HOST')}' "
+            f"port='{os.getenv('DB_PORT')}' sslmode='{ssl_mode}'")
+
+def get_db_pool():
+    # Created lazily so the API still starts (and retries later) if the database is down at boot.
+    global DB_POOL
+    if DB_POOL is None:
+        with DB_POOL_LOCK:
+            if DB_POOL is None:
+                DB_POOL = psycopg2.pool.ThreadedConnectionPool(
+                    int(os.getenv('DB_POOL_MIN', 2)), int(os.getenv('DB_POOL_MAX', 20)), get_db_dsn())
+    return DB_POOL
+
 def get_db_connection():
     try:
-        ssl_mode = os.getenv('DB_SSLMODE', 'require')
-        dsn = (f"dbname='{os.getenv('DB_NAME')}' user='{os.getenv('DB_USER')}' "
-               f"password='{os.getenv('DB_PASSWORD')}' host='{os.getenv('DB_HOST')}' "
-               f"port='{os.getenv('DB_PORT')}' sslmode='{ssl_mode}'")
-        return psycopg2.connect(dsn)
-    except psycopg2.OperationalError as err:
+        connection = get_db_pool().getconn()
+        if connection.closed:
+            # The server dropped this pooled connection; discard it and hand out a fresh one.
+            DB_POOL.putconn(connection, close=True)
+            connection = DB_POOL.getconn()
+        return connection
+    except (psycopg2.OperationalError, psycopg2.pool.PoolError) as err:
         print(f"Error connecting to database: {err}")
         return None
 
-def get_or_create_user(cursor, username):
-    cursor.execute("SELECT user_id FROM users WHERE username = %s", (username,))
-    result = cursor.fetchone()
-    if result:
-        return result['user_id']
-    else:
-        cursor.execute("INSERT INTO users (username) VALUES (%s) RETURNING user_id", (username,))
-        return cursor.fetchone()['user_id']
+def release_db_connection(connection):
+    if not connection: return
+    if not connection.closed:
+        # Never hand a connection with an open transaction back to the pool.
+        connection.rollback()
+    DB_POOL.putconn(connection, close=bool(connection.closed))
 
-def get_youtube_id_from_url(url):
-    if not isinstance(url, str): return None
-    match = re.search(r"(?:v=|\/)([a-zA-Z0-9_-]{11})", url)
-    return match.group(1) if match else None
+@contextmanager
+def db_conn():
+    # Yields a pooled connection (or None if the database is unreachable) and always returns it to the pool.
+    connection = get_db_connection()
+    try:
+        yield connection
+    finally:
+        release_db_connection(connection)
+
+# Hot queries are PREPAREd once per pooled connection so Postgres reuses the parsed plan across requests.
+PREPARED_STATEMENTS = {
+    'get_taste_profile': "PREPARE get_taste_profile(int) AS SELECT taste_profile FROM user_taste_profiles WHERE user_id = $1",
+    'upsert_taste_profile': ("PREPARE upsert_taste_profile(int, jsonb) AS INSERT INTO user_taste_profiles (user_id, taste_profile, last_updated) VALUES ($1, $2, NOW()) "
+                             "ON CONFLICT (user_id) DO UPDATE SET taste_profile = EXCLUDED.taste_profile, last_updated = NOW() RETURNING taste_profile"),
+    'search_titles': "PREPARE search_titles(text) AS SELECT title, title_english FROM animes WHERE (title ILIKE $1 OR title_english ILIKE $1) LIMIT 10",
+    # Both deletes travel in one statement (and one round-trip) via a data-modifying CTE.
+    'delete_user': "PREPARE delete_user(int) AS WITH deleted_profile AS (DELETE FROM user_taste_profiles WHERE user_id = $1) DELETE FROM users WHERE user_id = $1",
+    # LATERAL ... LIMIT 2 stops each anime's scan at the two reviews a reel card shows.
+    'get_reviews': ("PREPARE get_reviews(int[]) AS SELECT t.anime_id, r.review_text, r.sentiment_polarity FROM unnest($1) AS t(anime_id) "
+                    "CROSS JOIN LATERAL (SELECT review_text, sentiment_polarity FROM reviews WHERE reviews.anime_id = t.anime_id LIMIT 2) r"),
+}
+PREPARED_ON_CONNECTION = weakref.WeakKeyDictionary()
+
+def execute_prepared(cursor, name, params):
+    prepared = PREPARED_ON_CONNECTION.setdefault(cursor.connection, set())
+    if name not in prepared:
+        cursor.execute(PREPARED_STATEMENTS[name])
+        prepared.add(name)
+    cursor.execute(f"EXECUTE {name}({', '.join(['%s'] * len(params))})", params)
+
+# Resolves (or creates) the user and fetches their profile in one round-trip; the default profile is only written when none exists.
+USER_SESSION_SQL = """
+    WITH existing_user AS (SELECT user_id FROM users WHERE username = %(username)s LIMIT 1),
+    new_user AS (
+        INSERT INTO users (username) SELECT %(username)s WHERE NOT EXISTS (SELECT 1 FROM existing_user) RETURNING user_id),
+    session_user_id AS (SELECT user_id FROM existing_user UNION ALL SELECT user_id FROM new_user),
+    existing_profile AS (
+        SELECT p.taste_profile FROM user_taste_profiles p JOIN session_user_id s ON p.user_id = s.user_id WHERE p.taste_profile IS NOT NULL),
+    new_profile AS (
+        INSERT INTO user_taste_profiles (user_id, taste_profile, last_updated)
+        SELECT user_id, %(default_profile)s::jsonb, NOW() FROM session_user_id WHERE NOT EXISTS (SELECT 1 FROM existing_profile)
+        ON CONFLICT (user_id) DO UPDATE SET taste_profile = EXCLUDED.taste_profile, last_updated = NOW())
+    SELECT user_id, (SELECT taste_profile FROM existing_profile) FROM session_user_id
+"""
+
+PROFILE_CACHE = redis.Redis.from_url(os.getenv('REDIS_URL')) if redis is not None and os.getenv('REDIS_URL') else None
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 3600))
+
+def cache_taste_profile(user_id, profile):
+    # Only called with committed data; None drops the entry. Cache failures never fail the request.
+    if PROFILE_CACHE is None: return
+    try:
+        if profile is None:
+            PROFILE_CACHE.delete(f"tp:{user_id}")
+        else:
+            PROFILE_CACHE.set(f"tp:{user_id}", dumps_json(profile), ex=PROFILE_CACHE_TTL)
+    except redis.RedisError as err:
+        print(f"Profile cache error: {err}")
+
+def get_taste_profile(cursor, user_id):
+    # Redis first (when configured), then Postgres. Returns None when the user has no stored profile.
+    if PROFILE_CACHE is not None:
+        try:
+            cached = PROFILE_CACHE.get(f"tp:{user_id}")
+            if cached is not None: return loads_json(cached)
+        except redis.RedisError as err:
+            print(f"Profile cache error: {err}")
+    execute_prepared(cursor, 'get_taste_profile', (user_id,))
+    res = cursor.fetchone()
+    profile = res[0] if res and res[0] else None
+    if profile is not None: cache_taste_profile(user_id, profile)
+    return profile
+
+def get_or_create_user(cursor, username, default_profile):
+    # Returns (user_id, stored taste_profile or None if default_profile was saved).
+    cursor.execute(USER_SESSION_SQL, {'username': username, 'default_profile': to_jsonb(default_profile)})
+    return cursor.fetchone()
+
+def to_unit_vector(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def get_most_similar_indices(taste_vector, k, exclude_indices=()):
+    """Returns up to k row indices ordered by cosine similarity to taste_vector, skipping exclude_indices."""
+    query = to_unit_vector(taste_vector).astype(np.float32)
+    k = min(k, len(feature_matrix_norm))
+    if SIMILARITY_INDEX is not None:
+        excluded = set(exclude_indices)
+        _, found = SIMILARITY_INDEX.search(query.reshape(1, -1), min(k + len(excluded), len(feature_matrix_norm)))
+        return [i for i in found[0].tolist() if i not in excluded][:k]
+    similarity_scores = feature_matrix_norm @ query
+    # Excluded anime can never be returned, so push them to the bottom before selecting
+    similarity_scores[list(exclude_indices)] = -np.inf
+    # Only the best few candidates are needed: partition out the top k, then sort just those
+    top_indices = np.argpartition(-similarity_scores, k - 1)[:k]
+    return top_indices[np.argsort(-similarity_scores[top_indices])].tolist()
 
 # --- 4. FLASK API ENDPOINTS ---
 # ... (rest of the imports and setup code)
@@ -94,29 +295,22 @@ def suggest_anime():
             return jsonify({"suggestions": []}) # No matching anime found in our data
             
         # Create an average vector representing the user's taste profile
-        user_taste_vector = np.mean([feature_matrix[i] for i in liked_indices], axis=0).reshape(1, -1)
+        user_taste_vector = feature_matrix[liked_indices].mean(axis=0)
         
-        # --- 3. Calculate similarity between the user's taste and all other anime ---
-        similarity_scores = cosine_similarity(user_taste_vector, feature_matrix)[0]
-        
-        # --- 4. Rank anime and get the top suggestions ---
-        # Pair each anime index with its similarity score
-        scored_indices = list(enumerate(similarity_scores))
-        
-        # Sort by score in descending order
-        sorted_scored_indices = sorted(scored_indices, key=lambda x: x[1], reverse=True)
+        # --- 3 & 4. Rank all anime by similarity to the user's taste and keep the best few ---
+        # Create a set of liked titles for efficient lookup
+        liked_titles_set = set(liked_anime_titles)
+        top_indices = get_most_similar_indices(user_taste_vector, 3 + len(liked_titles_set), exclude_indices=liked_indices)
         
         # --- 5. Filter and format the results ---
         suggestions = []
-        # Create a set of liked titles for efficient lookup
-        liked_titles_set = set(liked_anime_titles)
         
-        for index, score in sorted_scored_indices:
+        for index in top_indices:
             # Stop when we have 3 suggestions
             if len(suggestions) >= 3:
                 break
             
-            anime_info = anime_df.iloc[index]
+            anime_info = ANIME_RECORDS[index]
             suggestion_title = anime_info.get('title_english') or anime_info.get('title')
             
             # Ensure the suggestion is not an anime the user has already liked
@@ -143,30 +337,26 @@ def status_check():
 def search_genres():
     query = request.args.get('q', '').lower()
     if not ASSETS_LOADED or len(query) < 1: return jsonify([])
-    results = [genre for genre in ALL_GENRES if query in genre.lower() and genre not in EXPLICIT_GENRES_SET]
-    return jsonify(results[:5])
+    return jsonify(GENRE_AUTOCOMPLETE.get(query, []))
 
 @app.route('/api/search_anime', methods=['GET'])
 def search_anime():
     query = request.args.get('q', '')
     if len(query) < 2: return jsonify([])
-    connection = get_db_connection()
-    if not connection: return jsonify({"error": "Database connection failed"}), 500
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    try:
-        search_term = f"%{query}%"
-        cursor.execute("SELECT title, title_english FROM animes WHERE (title ILIKE %s OR title_english ILIKE %s) LIMIT 10", (search_term, search_term))
-        results = []
-        seen_titles = set()
-        for row in cursor.fetchall():
-            display_title = row['title_english'] if row['title_english'] else row['title']
-            if display_title and display_title not in seen_titles:
-                results.append(display_title)
-                seen_titles.add(display_title)
-            if len(results) >= 5: break
-        return jsonify(results)
-    finally:
-        if connection: cursor.close(); connection.close()
+    with db_conn() as connection:
+        if not connection: return jsonify({"error": "Database connection failed"}), 500
+        with connection.cursor() as cursor:
+            search_term = f"%{query}%"
+            execute_prepared(cursor, 'search_titles', (search_term,))
+            results = []
+            seen_titles = set()
+            for title, title_english in cursor.fetchall():
+                display_title = title_english if title_english else title
+                if display_title and display_title not in seen_titles:
+                    results.append(display_title)
+                    seen_titles.add(display_title)
+                if len(results) >= 5: break
+            return jsonify(results)
 
 @app.route('/api/generate_reel', methods=['POST'])
 # UPDATED: generate_reel function with robust filtering.
@@ -176,117 +366,128 @@ def generate_reel():
     data = request.get_json()
     username, user_id, liked_anime_titles, allow_explicit, genres_filter = data.get('username'), data.get('user_id'), data.get('liked_anime', []), data.get('allow_explicit', False), data.get('genres', [])
     
-    connection = get_db_connection()
-    if not connection: return jsonify({"error": "Database connection failed"}), 500
-    try:
-        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            is_new_user_session = 'username' in data
-            if not user_id:
-                user_id = get_or_create_user(cursor, username)
+    with db_conn() as connection:
+        if not connection: return jsonify({"error": "Database connection failed"}), 500
+        try:
+            with connection.cursor() as cursor:
+                is_new_user_session = 'username' in data
+                if not user_id:
+                    initial_profile = get_initial_profile(liked_anime_titles)
+                    user_id, stored_profile = get_or_create_user(cursor, username, initial_profile)
+                    user_profile = stored_profile or initial_profile
+                    profile_to_cache = user_profile
+                else:
+                    user_profile = get_taste_profile(cursor, user_id)
+                    profile_to_cache = None
+                    if user_profile is None:
+                        user_profile = profile_to_cache = get_initial_profile(liked_anime_titles)
+                        execute_prepared(cursor, 'upsert_taste_profile', (user_id, to_jsonb(user_profile)))
                 connection.commit()
-            cursor.execute("SELECT taste_profile FROM user_taste_profiles WHERE user_id = %s", (user_id,))
-            res = cursor.fetchone()
-            if res and res['taste_profile']:
-                user_profile = res['taste_profile']
+                if profile_to_cache is not None: cache_taste_profile(user_id, profile_to_cache)
                 liked_anime_ids = user_profile.get('liked_ids', [])
-            else:
-                title_map = get_title_to_id_map(liked_anime_titles)
-                liked_anime_ids = [title_map.get(t) for t in liked_anime_titles if t in title_map]
-                user_profile = {'liked_ids': liked_anime_ids, 'disliked_ids': [], 'scrolled_past_ids': []}
-                cursor.execute("INSERT INTO user_taste_profiles (user_id, taste_profile, last_updated) VALUES (%s, %s, NOW()) ON CONFLICT (user_id) DO UPDATE SET taste_profile = EXCLUDED.taste_profile, last_updated = NOW()", (user_id, json.dumps(user_profile)))
-                connection.commit()
 
-        seen_from_client = {int(i) for i in data.get('seen_anime_ids', [])}
-        liked_from_db = {int(i) for i in user_profile.get('liked_ids', [])}
-        disliked_from_db = {int(i) for i in user_profile.get('disliked_ids', [])}
-        scrolled_from_db = {int(i) for i in user_profile.get('scrolled_past_ids', [])}
-        
-        # FIX: Create a single, definitive exclusion set from all sources.
-        final_exclusion_set = seen_from_client | liked_from_db | disliked_from_db | scrolled_from_db
-        
-        if not liked_anime_ids:
-            ranked_recs = get_fallback_recommendations(final_exclusion_set, allow_explicit, genres_filter)
-            recommendation_type = "fallback_cold_start"
-        else:
-            liked_indices = [id_to_index[i] for i in liked_anime_ids if i in id_to_index]
-            if not liked_indices:
+            seen_from_client = {int(i) for i in data.get('seen_anime_ids', [])}
+            liked_from_db = {int(i) for i in user_profile.get('liked_ids', [])}
+            disliked_from_db = {int(i) for i in user_profile.get('disliked_ids', [])}
+            scrolled_from_db = {int(i) for i in user_profile.get('scrolled_past_ids', [])}
+            
+            # FIX: Create a single, definitive exclusion set from all sources.
+            final_exclusion_set = seen_from_client | liked_from_db | disliked_from_db | scrolled_from_db
+            
+            if not liked_anime_ids:
                 ranked_recs = get_fallback_recommendations(final_exclusion_set, allow_explicit, genres_filter)
-                recommendation_type = "fallback_no_match"
+                recommendation_type = "fallback_cold_start"
             else:
-                user_profile_vector, top_genres, studio_prefs = build_user_profile_from_indices(liked_indices)
-                df_pool = anime_df[anime_df['promo_link'].notna() & (anime_df['promo_link'] != '')]
-                if not allow_explicit:
-                    is_explicit = df_pool['genre_list'].apply(lambda genres: isinstance(genres, list) and not EXPLICIT_GENRES_SET.isdisjoint(genres))
-                    df_pool = df_pool[~is_explicit]
-                if genres_filter:
-                    required_genres = set(genres_filter)
-                    df_pool = df_pool[df_pool['genre_list'].apply(lambda g_list: isinstance(g_list, list) and required_genres.issubset(set(g_list)))]
-
-                all_possible_ids = set(df_pool['anime_id'])
-                
-                # FIX: Explicitly and consistently filter the candidate pool before scoring.
-                candidate_ids = list(all_possible_ids - final_exclusion_set)
-                
-                ranked_recs = predict_scores_for_candidates(candidate_ids, user_profile_vector, top_genres, studio_prefs, limit=15)
-                if is_new_user_session and liked_indices:
-                    initial_taste_vector = np.mean([feature_matrix[i] for i in liked_indices], axis=0).reshape(1, -1)
-                    boosted_recs = []
-                    for rec in ranked_recs:
-                        rec_id = rec['anime']['anime_id']
-                        if rec_id in id_to_index:
-                            rec_vector = feature_matrix[id_to_index[rec_id]].reshape(1, -1)
-                            similarity = cosine_similarity(initial_taste_vector, rec_vector)[0][0]
-                            boost = similarity * 5.0
-                            rec['score'] += boost
-                            boosted_recs.append(rec)
-                    ranked_recs = sorted(boosted_recs, key=lambda x: x['score'], reverse=True)
-                recommendation_type = "personalized_model"
-        
-        final_response = format_response_with_reviews(ranked_recs)
-        return jsonify({"user_id": user_id, "recommendations": final_response, "recommendation_type": recommendation_type})
-    except Exception as e:
-        print(f"Error in generate_reel: {e}")
-        return jsonify({"error": "Internal error occurred"}), 500
-    finally:
-        if connection and not connection.closed: connection.close()
+                liked_indices = [id_to_index[i] for i in liked_anime_ids if i in id_to_index]
+                if not liked_indices:
+                    ranked_recs = get_fallback_recommendations(final_exclusion_set, allow_explicit, genres_filter)
+                    recommendation_type = "fallback_no_match"
+                else:
+                    user_profile_vector, top_genres, studio_prefs = get_cached_user_profile(tuple(liked_indices))
+                    candidate_idx = get_candidate_indices(allow_explicit, genres_filter)
+                    all_possible_ids = set(anime_df['anime_id'].to_numpy()[candidate_idx].tolist())
+                    
+                    # FIX: Explicitly and consistently filter the candidate pool before scoring.
+                    candidate_ids = list(all_possible_ids - final_exclusion_set)
+                    
+                    ranked_recs = predict_scores_for_candidates(candidate_ids, user_profile_vector, top_genres, studio_prefs, limit=15)
+                    if is_new_user_session and liked_indices:
+                        initial_taste_vector = to_unit_vector(user_profile_vector)
+                        boosted_recs = [rec for rec in ranked_recs if rec['anime']['anime_id'] in id_to_index]
+                        rec_indices = [id_to_index[rec['anime']['anime_id']] for rec in boosted_recs]
+                        # One matrix-vector product scores every recommendation against the initial taste
+                        boosts = (feature_matrix_norm[rec_indices] @ initial_taste_vector) * 5.0
+                        for rec, boost in zip(boosted_recs, boosts):
+                            rec['score'] += float(boost)
+                        ranked_recs = sorted(boosted_recs, key=lambda x: x['score'], reverse=True)
+                    recommendation_type = "personalized_model"
+            
+            # Reviews are fetched on the same pooled connection.
+            with connection.cursor() as cursor:
+                final_response = format_response_with_reviews(ranked_recs, cursor)
+            return jsonify({"user_id": user_id, "recommendations": final_response, "recommendation_type": recommendation_type})
+        except Exception as e:
+            print(f"Error in generate_reel: {e}")
+            return jsonify({"error": "Internal error occurred"}), 500
+
+# Removes the affected ids from one taste_profile list (jsonb) and appends that list's additions.
+FEEDBACK_DELTA_LIST = "COALESCE((SELECT jsonb_agg(e) FROM jsonb_array_elements(COALESCE(taste_profile->'{key}', '[]'::jsonb)) e WHERE (e #>> '{{}}')::int <> ALL(%(affected_ids)s::int[])), '[]'::jsonb) || %({added})s::jsonb"
+FEEDBACK_DELTA_SQL = (
+    "UPDATE user_taste_profiles SET taste_profile = COALESCE(taste_profile, '{}'::jsonb) || jsonb_build_object("
+    "'liked_ids', " + FEEDBACK_DELTA_LIST.format(key='liked_ids', added='liked_added') + ", "
+    "'disliked_ids', " + FEEDBACK_DELTA_LIST.format(key='disliked_ids', added='disliked_added') + ", "
+    "'scrolled_past_ids', " + FEEDBACK_DELTA_LIST.format(key='scrolled_past_ids', added='scrolled_added') + "), "
+    "last_updated = NOW() WHERE user_id = %(user_id)s RETURNING taste_profile"
+)
 
 @app.route('/api/feedback', methods=['POST'])
 def handle_feedback():
     data = request.get_json()
     user_id, anime_id, reason = data.get('user_id'), data.get('animeId'), data.get('reason')
     if not all([user_id, anime_id, reason]): return jsonify({"error": "Missing data"}), 400
-    connection = get_db_connection()
-    if not connection: return jsonify({"error": "Database down"}), 500
-    try:
-        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            affected_ids = get_related_anime_ids(cursor, anime_id)
-            cursor.execute("SELECT taste_profile FROM user_taste_profiles WHERE user_id = %s", (user_id,))
-            res = cursor.fetchone()
-            profile = res['taste_profile'] if res and res['taste_profile'] else {}
-            liked_ids = profile.get('liked_ids', [])
-            disliked_ids = set(profile.get('disliked_ids', []))
-            scrolled_past_ids = set(profile.get('scrolled_past_ids', []))
-            liked_ids = [i for i in liked_ids if i not in affected_ids]
-            disliked_ids.difference_update(affected_ids)
-            scrolled_past_ids.difference_update(affected_ids)
-            if reason in ('like_button', 'save_to_watchlist', 'watched_10_seconds'):
-                liked_ids.extend(affected_ids)
-            elif reason == 'super_like_button':
-                liked_ids.extend(affected_ids * 3)
-            elif reason == 'not_interested_button':
-                disliked_ids.update(affected_ids)
-            elif reason == 'scrolled_past':
-                if not(set(liked_ids).intersection(affected_ids) or disliked_ids.intersection(affected_ids)):
-                    scrolled_past_ids.update(affected_ids)
-            updated_profile = {'liked_ids': liked_ids, 'disliked_ids': list(disliked_ids), 'scrolled_past_ids': list(scrolled_past_ids)}
-            cursor.execute("INSERT INTO user_taste_profiles (user_id, taste_profile, last_updated) VALUES (%s, %s, NOW()) ON CONFLICT (user_id) DO UPDATE SET taste_profile = EXCLUDED.taste_profile, last_updated = NOW()", (user_id, json.dumps(updated_profile)))
-            connection.commit()
-        return jsonify({"status": "success", "profile": updated_profile, "affected_ids": list(affected_ids)}), 200
-    except Exception as e:
-        print(f"Error in feedback: {e}")
-        return jsonify({"error": "Internal error"}), 500
-    finally:
-        if connection: connection.close()
+    with db_conn() as connection:
+        if not connection: return jsonify({"error": "Database down"}), 500
+        try:
+            with connection.cursor() as cursor:
+                affected_ids = get_related_anime_ids(cursor, anime_id)
+                stored_profile = get_taste_profile(cursor, user_id)
+                profile = stored_profile or {}
+                liked_ids = profile.get('liked_ids', [])
+                disliked_ids = set(profile.get('disliked_ids', []))
+                scrolled_past_ids = set(profile.get('scrolled_past_ids', []))
+                liked_ids = [i for i in liked_ids if i not in affected_ids]
+                disliked_ids.difference_update(affected_ids)
+                scrolled_past_ids.difference_update(affected_ids)
+                liked_added, disliked_added, scrolled_added = [], [], []
+                if reason in ('like_button', 'save_to_watchlist', 'watched_10_seconds'):
+                    liked_added = list(affected_ids)
+                elif reason == 'super_like_button':
+                    liked_added = list(affected_ids) * 3
+                elif reason == 'not_interested_button':
+                    disliked_added = list(affected_ids)
+                elif reason == 'scrolled_past':
+                    if not(set(liked_ids).intersection(affected_ids) or disliked_ids.intersection(affected_ids)):
+                        scrolled_added = list(affected_ids)
+                liked_ids.extend(liked_added)
+                disliked_ids.update(disliked_added)
+                scrolled_past_ids.update(scrolled_added)
+                updated_profile = {'liked_ids': liked_ids, 'disliked_ids': list(disliked_ids), 'scrolled_past_ids': list(scrolled_past_ids)}
+                if stored_profile is not None:
+                    # Existing profiles only receive the delta; Postgres strips the affected ids and appends the additions in place.
+                    cursor.execute(FEEDBACK_DELTA_SQL, {
+                        'user_id': user_id, 'affected_ids': [int(i) for i in affected_ids],
+                        'liked_added': to_jsonb(liked_added), 'disliked_added': to_jsonb(disliked_added), 'scrolled_added': to_jsonb(scrolled_added),
+                    })
+                else:
+                    execute_prepared(cursor, 'upsert_taste_profile', (user_id, to_jsonb(updated_profile)))
+                saved = cursor.fetchone()
+                connection.commit()
+            # The row Postgres actually wrote is cached, so concurrent deltas are never lost from the cache.
+            cache_taste_profile(user_id, saved[0] if saved else None)
+            return jsonify({"status": "success", "profile": updated_profile, "affected_ids": list(affected_ids)}), 200
+        except Exception as e:
+            print(f"Error in feedback: {e}")
+            return jsonify({"error": "Internal error"}), 500
 
 @app.route('/api/rescore', methods=['POST'])
 def rescore_recommendations():
@@ -294,101 +495,114 @@ def rescore_recommendations():
     data = request.get_json()
     user_id, anime_ids = data.get('user_id'), [int(i) for i in data.get('anime_ids', [])]
     if not all([user_id, anime_ids]): return jsonify({"error": "Missing data"}), 400
-    connection = get_db_connection()
-    if not connection: return jsonify({"error": "Database down"}), 500
-    try:
-        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            cursor.execute("SELECT taste_profile FROM user_taste_profiles WHERE user_id = %s", (user_id,))
-            res = cursor.fetchone()
-        if not res or not res['taste_profile']: return jsonify({})
-        profile = res['taste_profile']
-        liked_anime_ids = profile.get('liked_ids', [])
-        if not liked_anime_ids: return jsonify({})
-        liked_indices = [id_to_index[i] for i in liked_anime_ids if i in id_to_index]
-        if not liked_indices: return jsonify({})
-        user_profile_vector, top_genres, studio_prefs = build_user_profile_from_indices(liked_indices)
-        ranked_recs = predict_scores_for_candidates(anime_ids, user_profile_vector, top_genres, studio_prefs)
-        new_scores = {str(rec['anime']['anime_id']): rec['score'] for rec in ranked_recs}
-        return jsonify(new_scores)
-    except Exception as e:
-        print(f"Error in rescore: {e}")
-        return jsonify({"error": "Internal error"}), 500
-    finally:
-        if connection: connection.close()
+    with db_conn() as connection:
+        if not connection: return jsonify({"error": "Database down"}), 500
+        try:
+            with connection.cursor() as cursor:
+                profile = get_taste_profile(cursor, user_id)
+            if not profile: return jsonify({})
+            liked_anime_ids = profile.get('liked_ids', [])
+            if not liked_anime_ids: return jsonify({})
+            liked_indices = [id_to_index[i] for i in liked_anime_ids if i in id_to_index]
+            if not liked_indices: return jsonify({})
+            user_profile_vector, top_genres, studio_prefs = get_cached_user_profile(tuple(liked_indices))
+            ranked_recs = predict_scores_for_candidates(anime_ids, user_profile_vector, top_genres, studio_prefs)
+            new_scores = {str(rec['anime']['anime_id']): rec['score'] for rec in ranked_recs}
+            return jsonify(new_scores)
+        except Exception as e:
+            print(f"Error in rescore: {e}")
+            return jsonify({"error": "Internal error"}), 500
 
 @app.route('/api/user/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
-    connection = get_db_connection()
-    if not connection: return jsonify({"error": "Database connection failed"}), 500
-    cursor = connection.cursor()
-    try:
-        cursor.execute("DELETE FROM user_taste_profiles WHERE user_id = %s", (user_id,))
-        cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
-        connection.commit()
-        return jsonify({"status": "success"}), 200
-    finally:
-        if connection: cursor.close(); connection.close()
+    with db_conn() as connection:
+        if not connection: return jsonify({"error": "Database connection failed"}), 500
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, 'delete_user', (user_id,))
+            connection.commit()
+            cache_taste_profile(user_id, None)
+            return jsonify({"status": "success"}), 200
 
 def get_related_anime_ids(cursor, anime_id):
-    cursor.execute("SELECT title, title_english FROM animes WHERE anime_id = %s", (anime_id,))
-    title_row = cursor.fetchone()
-    if not title_row: return [anime_id]
-    base_title = (title_row['title_english'] or title_row['title']).split(':')[0].split(' Season')[0].strip()
-    cursor.execute("SELECT anime_id FROM animes WHERE title ILIKE %s OR title_english ILIKE %s", (f"{base_title}%", f"{base_title}%"))
-    return [row['anime_id'] for row in cursor.fetchall()]
+    base_title = ID_TO_BASE_TITLE.get(anime_id)
+    if base_title is None:
+        # Anime outside the loaded catalog: fall back to the database prefix scan.
+        cursor.execute("SELECT title, title_english FROM animes WHERE anime_id = %s", (anime_id,))
+        title_row = cursor.fetchone()
+        if not title_row: return [anime_id]
+        base_title = get_base_title(title_row[1] or title_row[0])
+        cursor.execute("SELECT anime_id FROM animes WHERE title ILIKE %s OR title_english ILIKE %s", (f"{base_title}%", f"{base_title}%"))
+        return [row[0] for row in cursor.fetchall()]
+    if not base_title: return [anime_id]
+    start = bisect_left(TITLE_PREFIX_KEYS, base_title)
+    related_ids = []
+    for title, related_id in TITLE_PREFIX_INDEX[start:]:
+        if not title.startswith(base_title): break
+        related_ids.append(related_id)
+    return list(dict.fromkeys(related_ids))
 
 def build_user_profile_from_indices(liked_indices):
-    user_profile_vector = np.mean([feature_matrix[i] for i in liked_indices], axis=0)
+    user_profile_vector = feature_matrix[liked_indices].mean(axis=0)
     user_rated_df = anime_df.iloc[liked_indices]
-    top_genres = pd.Series([g for sublist in user_rated_df['genre_list'] if isinstance(sublist, list) for g in sublist]).value_counts().nlargest(5).index.tolist()
-    studio_prefs = user_rated_df.groupby('studio').size() / len(user_rated_df)
+    # most_common() keeps first-seen order on ties.
+    top_genres = [g for g, _ in Counter(g for sublist in user_rated_df['genre_list'] if isinstance(sublist, list) for g in sublist).most_common(5)]
+    studio_prefs = user_rated_df['studio'].value_counts() / len(user_rated_df)
     return user_profile_vector, top_genres, studio_prefs
 
+@lru_cache(maxsize=1024)
+def get_cached_user_profile(liked_indices):
+    # Keyed on the exact liked tuple (duplicates from super-likes included), so any feedback that
+    # changes liked_ids naturally misses the cache. Callers must treat the result as read-only.
+    return build_user_profile_from_indices(list(liked_indices))
+
 def predict_scores_for_candidates(candidate_ids, user_profile_vector, top_genres, studio_prefs, limit=None):
-    pred_features, valid_ids = [], []
-    for anime_id in candidate_ids:
-        if anime_id in id_to_index:
-            idx, info = id_to_index[anime_id], anime_df.iloc[id_to_index[anime_id]]
-            vector = feature_matrix[idx]
-            genres = info['genre_list'] if isinstance(info['genre_list'], list) else []
-            g_match = sum(1 for g in genres if g in top_genres) / 5.0 if top_genres else 0
-            s_pref = studio_prefs.get(info['studio'], 0)
-            i_features = np.array([g_match, s_pref])
-            combined = np.concatenate([user_profile_vector, vector, i_features])
-            pred_features.append(combined)
-            valid_ids.append(anime_id)
-    if not pred_features: return []
-    scores = model.predict(np.array(pred_features))
-    recs_with_scores = sorted(zip(valid_ids, scores), key=lambda x: x[1], reverse=True)
+    valid_ids = [anime_id for anime_id in candidate_ids if anime_id in id_to_index]
+    if not valid_ids: return []
+    valid_indices = np.fromiter((id_to_index[anime_id] for anime_id in valid_ids), dtype=np.int64, count=len(valid_ids))
+    # Features are written straight into one preallocated matrix: [user profile | anime vector | g_match, s_pref]
+    n_user, n_item = len(user_profile_vector), feature_matrix.shape[1]
+    # float32 is what the tree ensemble predicts on internally, so building it directly avoids a cast copy.
+    pred_features = np.empty((len(valid_ids), n_user + n_item + 2), dtype=np.float32)
+    pred_features[:, :n_user] = user_profile_vector
+    pred_features[:, n_user:n_user + n_item] = feature_matrix[valid_indices]
+    if top_genres:
+        top_genre_cols = [GENRE_INDEX[g] for g in top_genres]
+        pred_features[:, -2] = GENRE_MATRIX[np.ix_(valid_indices, top_genre_cols)].sum(axis=1) / 5.0
+    else:
+        pred_features[:, -2] = 0
+    # Trailing 0 is the preference for code -1 (no studio).
+    studio_pref_table = np.append(studio_prefs.reindex(STUDIO_NAMES).fillna(0).to_numpy(), 0.0)
+    pred_features[:, -1] = studio_pref_table[STUDIO_CODES[valid_indices]]
+    scores = model.predict(pred_features)
+    order = np.arange(len(scores))
+    if limit and len(scores) > limit:
+        # Only rows tied with or above the limit-th best score can make the cut; ties are kept so the order matches a full sort.
+        order = np.flatnonzero(scores >= np.partition(scores, -limit)[-limit])
+    order = order[np.argsort(-scores[order], kind='stable')]
     if limit:
-        recs_with_scores = recs_with_scores[:limit]
-    return [{'anime': anime_df.iloc[id_to_index[anime_id]].to_dict(), 'score': score} for anime_id, score in recs_with_scores]
+        order = order[:limit]
+    return [{'anime': ANIME_RECORDS[valid_indices[i]], 'score': scores[i]} for i in order]
 
-def format_response_with_reviews(recommendations):
+def format_response_with_reviews(recommendations, cursor):
     if not recommendations: return []
     anime_ids = [rec['anime']['anime_id'] for rec in recommendations]
     reviews_map = {}
-    connection = get_db_connection()
-    if connection:
-        try:
-            with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute("SELECT anime_id, review_text, sentiment_polarity FROM reviews WHERE anime_id = ANY(%s)", (anime_ids,))
-                for row in cursor.fetchall():
-                    if row['anime_id'] not in reviews_map: reviews_map[row['anime_id']] = []
-                    reviews_map[row['anime_id']].append(row)
-        except Exception as e: print(f"Error fetching reviews: {e}")
-        finally:
-            if connection: connection.close()
+    try:
+        execute_prepared(cursor, 'get_reviews', (anime_ids,))
+        # Plain tuple rows: (anime_id, review_text, sentiment_polarity).
+        for review_anime_id, review_text, sentiment_polarity in cursor.fetchall():
+            reviews_map.setdefault(review_anime_id, []).append((review_text, sentiment_polarity))
+    except Exception as e: print(f"Error fetching reviews: {e}")
     final_response = []
     for rec in recommendations:
         anime, anime_id = rec['anime'], rec['anime']['anime_id']
         reviews = reviews_map.get(anime_id, [])
-        comments = [{"user": "User", "text": r['review_text'], "type": "positive" if r['sentiment_polarity'] > 0.1 else "negative"} for r in reviews[:2]]
+        comments = [{"user": "User", "text": text, "type": "positive" if polarity > 0.1 else "negative"} for text, polarity in reviews[:2]]
         genre_list = anime.get('genre_list', [])
         if not isinstance(genre_list, list): genre_list = []
         final_response.append({
             "id": anime_id, "title": anime.get('title_english') or anime.get('title'),
-            "trailerId": get_youtube_id_from_url(anime.get('promo_link')),
+            "trailerId": TRAILER_IDS[id_to_index[anime_id]] if anime_id in id_to_index else get_youtube_id_from_url(anime.get('promo_link')),
             "score": anime.get('mean_score'), "rank": anime.get('overal_rank'),
             "genres": ', '.join(genre_list), "comments": comments, 
             "initial_score": rec['score'], "positive_keywords": anime.get('positive_keywords'),
@@ -396,33 +610,45 @@ def format_response_with_reviews(recommendations):
         })
     return final_response
 
+def get_initial_profile(liked_anime_titles):
+    title_map = get_title_to_id_map(liked_anime_titles)
+    liked_anime_ids = [title_map.get(t) for t in liked_anime_titles if t in title_map]
+    return {'liked_ids': liked_anime_ids, 'disliked_ids': [], 'scrolled_past_ids': []}
+
 def get_title_to_id_map(titles):
     if not titles: return {}
-    mask = anime_df['title'].isin(titles) | anime_df['title_english'].isin(titles)
-    df_slice = anime_df.loc[mask]
-    mapping = {}
-    if not df_slice.empty:
-        map1 = pd.Series(df_slice.anime_id.values, index=df_slice.title).to_dict()
-        map2 = pd.Series(df_slice.anime_id.values, index=df_slice.title_english).dropna().to_dict()
-        mapping.update(map1)
-        mapping.update(map2)
-    return mapping
+    # English titles take precedence over romaji titles.
+    return {t: TITLE_EN_TO_ID[t] if t in TITLE_EN_TO_ID else TITLE_TO_ID[t]
+            for t in titles if t in TITLE_EN_TO_ID or t in TITLE_TO_ID}
 
-def get_fallback_recommendations(seen_ids, allow_explicit=False, genres_filter=None):
-    df_pool = anime_df[anime_df['promo_link'].notna() & (anime_df['promo_link'] != '')]
+def get_candidate_indices(allow_explicit=False, genres_filter=None):
+    # Starts from the cached promo pool so only rows with a trailer are ever inspected.
+    mask = np.ones(len(PROMO_POOL_IDX), dtype=bool)
     if not allow_explicit:
-        is_explicit = df_pool['genre_list'].apply(lambda genres: isinstance(genres, list) and not EXPLICIT_GENRES_SET.isdisjoint(genres))
-        df_pool = df_pool[~is_explicit]
+        mask &= ~IS_EXPLICIT[PROMO_POOL_IDX]
     if genres_filter:
         required_genres = set(genres_filter)
-        df_pool = df_pool[df_pool['genre_list'].apply(lambda g_list: isinstance(g_list, list) and required_genres.issubset(set(g_list)))]
-    fallback_df = df_pool[~df_pool['anime_id'].isin(seen_ids)]
+        if not required_genres.issubset(GENRE_INDEX):
+            # A genre no anime carries can never be satisfied.
+            return PROMO_POOL_IDX[:0]
+        mask &= GENRE_MATRIX[np.ix_(PROMO_POOL_IDX, [GENRE_INDEX[g] for g in required_genres])].all(axis=1)
+    return PROMO_POOL_IDX[mask]
+
+def get_fallback_recommendations(seen_ids, allow_explicit=False, genres_filter=None):
+    candidate_idx = get_candidate_indices(allow_explicit, genres_filter)
+    fallback_df = anime_df.iloc[candidate_idx]
+    fallback_df = fallback_df[~fallback_df['anime_id'].isin(seen_ids)]
     fallback_df = fallback_df.sort_values('overal_rank', ascending=True).head(15)
     recs = []
-    for _, row in fallback_df.iterrows():
-        score = row.get('mean_score', 0) if pd.notna(row.get('mean_score')) else 0
-        recs.append({'anime': row.to_dict(), 'score': score})
+    for index in fallback_df.index:
+        anime = ANIME_RECORDS[index]
+        score = anime.get('mean_score', 0) if pd.notna(anime.get('mean_score')) else 0
+        recs.append({'anime': anime, 'score': score})
     return recs
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Production runs under gunicorn (see Procfile); the Flask dev server is only for local work.
+    if os.getenv('DEV'):
+        app.run(debug=True, port=5000)
+    else:
+        print("Run with gunicorn (see Procfile), or set DEV=1 to use the Flask dev server.")
\ No newline at end of file
@@ -1,11 +1,14 @@
 import os
 import mysql.connector
 from dotenv import load_dotenv
-import json
-from collections import Counter
+import numpy as np
+from json_utils import dumps_json
+from get_recommendations import PROFILE_MATRIX_PATH, profiles_version, save_profile_matrix, unit_rows
 
 # --- 1. SETUP ---
 load_dotenv()
+SAVE_PAGE_SIZE = 500
+
 
 # --- 2. DATABASE CONNECTION ---
 def get_db_connection():
@@ -26,12 +29,13 @@ def get_db_connection():
 
 # --- 3. CORE LOGIC ---
 
-def calculate_derived_rating(rank):
-    """Converts a user's rank into a weighted score."""
-    if rank is None or rank == 0:
-        return 0
+def calculate_derived_ratings(ranks):
+    """Converts an array of user ranks into weighted scores (0 for a missing or zero rank)."""
+    derived = np.zeros(len(ranks))
+    ranked = ranks != 0
     # This inverse function gives high weight to low ranks
-    return (1 / rank) * 10
+    derived[ranked] = (1 / ranks[ranked]) * 10
+    return derived
 
 def main():
     """
@@ -49,11 +53,13 @@ def main():
         print("\n[Step 1] Fetching all anime keywords and user rankings from DB...")
         
         # Fetch anime keywords into a dictionary for fast lookups
-        cursor.execute("SELECT anime_id, positive_keywords, negative_keywords FROM animes")
-        anime_keywords_map = {
-            anime_id: {'pos': pos_keys, 'neg': neg_keys}
-            for anime_id, pos_keys, neg_keys in cursor.fetchall()
-        }
+        # anime_keywords is derived from animes.positive_keywords / negative_keywords by process_reviews.py,
+        # the same rows get_recommendations.py aggregates.
+        cursor.execute("SELECT anime_id, keyword, sign FROM anime_keywords")
+        anime_keywords_map = {}
+        for anime_id, keyword, sign in cursor.fetchall():
+            keywords = anime_keywords_map.setdefault(anime_id, {'pos': [], 'neg': []})
+            keywords['pos' if sign > 0 else 'neg'].append(keyword)
 
         # Fetch all user rankings
         cursor.execute("SELECT user_id, anime_id, user_rank FROM user_watchlists WHERE user_rank IS NOT NULL")
@@ -63,22 +69,36 @@ def main():
         # --- Step 2: Calculate taste profile for each user ---
 
         print("\n[Step 2] Calculating taste profiles for each user...")
-        user_profiles = {} # A dictionary to hold profiles: {user_id: Counter(), ...}
-
-        for user_id, anime_id, rank in all_rankings:
-            if user_id not in user_profiles:
-                user_profiles[user_id] = Counter()
-
-            derived_rating = calculate_derived_rating(rank)
-            keywords = anime_keywords_map.get(anime_id)
-
-            if keywords:
-                if keywords['pos']:
-                    for keyword in keywords['pos'].split(', '):
-                        if keyword: user_profiles[user_id][keyword] += derived_rating
-                if keywords['neg']:
-                    for keyword in keywords['neg'].split(', '):
-                        if keyword: user_profiles[user_id][keyword] -= derived_rating
+
+        # Keywords become integer columns and each anime a (columns, +1/-1 signs) pair,
+        # so every (user, keyword) sum is computed in one numpy pass.
+        keyword_columns = {}
+        anime_columns = {}
+        for anime_id, keywords in anime_keywords_map.items():
+            columns = [keyword_columns.setdefault(k, len(keyword_columns)) for k in keywords['pos'] + keywords['neg']]
+            signs = [1.0] * len(keywords['pos']) + [-1.0] * len(keywords['neg'])
+            anime_columns[anime_id] = (np.array(columns, dtype=np.int64), np.array(signs))
+        keyword_names = list(keyword_columns)
+        no_columns = (np.empty(0, dtype=np.int64), np.empty(0))
+
+        user_ids = list(dict.fromkeys(user_id for user_id, _, _ in all_rankings))
+        user_rows = {user_id: row for row, user_id in enumerate(user_ids)}
+        ranking_rows = np.array([user_rows[user_id] for user_id, _, _ in all_rankings], dtype=np.int64)
+        derived_ratings = calculate_derived_ratings(np.array([rank or 0 for _, _, rank in all_rankings], dtype=np.float64))
+        ranking_columns = [anime_columns.get(anime_id, no_columns) for _, anime_id, _ in all_rankings]
+        lengths = np.array([len(columns) for columns, _ in ranking_columns], dtype=np.int64)
+
+        user_profiles = {user_id: {} for user_id in user_ids} # {user_id: {keyword: score}, ...}
+        pair_rows, pair_columns, pair_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        if lengths.sum():
+            columns = np.concatenate([columns for columns, _ in ranking_columns])
+            weights = np.concatenate([signs for _, signs in ranking_columns]) * np.repeat(derived_ratings, lengths)
+            # bincount adds the weights in ranking order.
+            pair_keys, pair_index = np.unique(np.repeat(ranking_rows, lengths) * len(keyword_names) + columns, return_inverse=True)
+            pair_scores = np.bincount(pair_index.ravel(), weights=weights)
+            pair_rows, pair_columns = pair_keys // len(keyword_names), pair_keys % len(keyword_names)
+            for row, column, score in zip(pair_rows.tolist(), pair_columns.tolist(), pair_scores.tolist()):
+                user_profiles[user_ids[row]][keyword_names[column]] = score
         
         print(f"-> Successfully calculated profiles for {len(user_profiles)} unique users.")
 
@@ -88,7 +108,7 @@ def main():
         
         # Prepare data for executemany, which is highly efficient
         profiles_to_save = [
-            (user_id, json.dumps(dict(profile)))
+            (user_id, dumps_json(profile))
             for user_id, profile in user_profiles.items()
         ]
 
@@ -98,9 +118,29 @@ def main():
                 VALUES (%s, %s)
                 ON DUPLICATE KEY UPDATE taste_profile = VALUES(taste_profile)
             """
-            cursor.executemany(save_query, profiles_to_save)
+            # executemany folds each page into one multi-row INSERT; paging keeps every statement under max_allowed_packet.
+            saved_count = 0
+            for start in range(0, len(profiles_to_save), SAVE_PAGE_SIZE):
+                cursor.executemany(save_query, profiles_to_save[start:start + SAVE_PAGE_SIZE])
+                saved_count += cursor.rowcount
             connection.commit()
-            print(f"-> Successfully saved or updated {cursor.rowcount} user profiles.")
+            print(f"-> Successfully saved or updated {saved_count} user profiles.")
+
+            # get_recommendations.py reads the profiles from this cache. It is tagged with the table's version
+            # (see profiles_version), so it is only written when these profiles are the whole table.
+            version = profiles_version(cursor)
+            profile_count = int(version.split(':')[0])
+            if profile_count != len(user_ids):
+                if os.path.exists(PROFILE_MATRIX_PATH):
+                    os.remove(PROFILE_MATRIX_PATH)
+                print(f"-> user_taste_profiles holds {profile_count} profiles, not {len(user_ids)}; get_recommendations.py will rebuild the cache.")
+            else:
+                # The sorted (user, keyword) pairs are already the user x keyword matrix in CSR layout.
+                indptr = np.concatenate(([0], np.cumsum(np.bincount(pair_rows, minlength=len(user_ids)))))
+                cache = {'data': unit_rows(pair_scores, indptr), 'indices': pair_columns.astype(np.int32),
+                         'indptr': indptr, 'user_ids': np.array(user_ids), 'vocab': np.array(keyword_names, dtype=str)}
+                if save_profile_matrix(cache, version):
+                    print(f"-> Cached the taste-profile matrix to '{PROFILE_MATRIX_PATH}'.")
 
     except mysql.connector.Error as err:
         print(f"An error occurred: {err}")
@@ -1,10 +1,8 @@
 import os
 import psycopg2
-import psycopg2.extras
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
-import random
 from tqdm import tqdm
 
 # --- 1. SETUP & DATABASE CONNECTION ---
@@ -28,21 +26,22 @@ def load_anime_features():
     try:
         feature_matrix = np.load('anime_feature_matrix.npy')
         anime_ids_df = pd.read_json('anime_ids.json', typ='series')
-        id_to_index = pd.Series(anime_ids_df.index, index=anime_ids_df.values)
+        # Plain dict: per-item lookups in the sampling loop are far cheaper than Series.__getitem__.
+        id_to_index = dict(zip(anime_ids_df.values.tolist(), anime_ids_df.index.tolist()))
         return feature_matrix, id_to_index
     except FileNotFoundError:
         print("ERROR: Feature files not found. Please run 'feature_engineering.py' first.")
         return None, None
 
-def get_all_user_watchlists(cursor):
+def get_all_user_watchlists(connection):
     print("Loading all user watchlists...")
     query = "SELECT user_id, anime_id, user_rank FROM user_watchlists"
-    cursor.execute(query)
-    user_data = {}
-    for user_id, anime_id, user_rank in cursor.fetchall():
-        if user_id not in user_data:
-            user_data[user_id] = []
-        user_data[user_id].append({'anime_id': anime_id, 'rank': user_rank})
+    with connection.cursor(name='watchlist_stream') as cursor:
+        cursor.itersize = 50000
+        cursor.execute(query)
+        user_data = {}
+        for user_id, anime_id, user_rank in cursor:
+            user_data.setdefault(user_id, []).append((anime_id, user_rank))
     print(f"Loaded watchlists for {len(user_data)} users.")
     return user_data
 
@@ -56,59 +55,56 @@ if __name__ == "__main__":
     if not connection:
         exit()
     
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    all_users_data = get_all_user_watchlists(connection)
+    # Sorted once so each user's negative pool is a single C-level set difference.
+    all_anime_ids = np.sort(np.fromiter(id_to_index, dtype=np.int64))
+    rng = np.random.default_rng()
     
-    all_users_data = get_all_user_watchlists(cursor)
-    all_anime_ids = set(id_to_index.index)
-    
-    X_data = []  # To store our feature vectors
-    y_data = []  # To store our labels (ranks)
+    # Pass 1 only picks rows (feature-matrix indices + labels) per user; vectors are copied once in pass 2.
+    user_samples = []  # (user_profile_vector, row_indices, labels)
 
     print("\nBuilding training dataset with positive and negative samples...")
     for user_id, watchlist in tqdm(all_users_data.items()):
         
-        # Build this user's profile vector (average of their liked anime)
-        liked_vectors = [feature_matrix[id_to_index[item['anime_id']]] for item in watchlist if item['anime_id'] in id_to_index]
-        if not liked_vectors:
+        # Build this user's profile vector (average of their liked anime) from one fancy-index gather
+        liked_indices = np.fromiter((id_to_index[anime_id] for anime_id, _ in watchlist if anime_id in id_to_index), dtype=np.int64)
+        if liked_indices.size == 0:
             continue
-        user_profile_vector = np.mean(liked_vectors, axis=0)
+        user_profile_vector = feature_matrix[liked_indices].mean(axis=0)
 
-        seen_anime = {item['anime_id'] for item in watchlist}
+        seen_anime = {anime_id for anime_id, _ in watchlist}
         
-        # 1. Add Positive Samples
-        for item in watchlist:
-            anime_id = item['anime_id']
-            if anime_id in id_to_index:
-                anime_vector = feature_matrix[id_to_index[anime_id]]
-                # Combine user profile and anime features into one vector
-                combined_vector = np.concatenate([user_profile_vector, anime_vector])
-                X_data.append(combined_vector)
-                
-                # The target is the inverse rank (higher rank = higher score)
-                # We add a small constant to avoid division by zero
-                y_data.append(1 / (item['rank'] + 0.1))
+        # 1. Positive Samples: the target is the inverse rank (higher rank = higher score)
+        # We add a small constant to avoid division by zero
+        row_indices = liked_indices.tolist()
+        labels = [1 / (rank + 0.1) for anime_id, rank in watchlist if anime_id in id_to_index]
 
-        # 2. Add Negative Samples
+        # 2. Negative Samples
         num_positive_samples = len(watchlist)
-        potential_negative_anime = list(all_anime_ids - seen_anime)
+        potential_negative_anime = np.setdiff1d(all_anime_ids, np.fromiter(seen_anime, dtype=np.int64), assume_unique=True)
         
-        if not potential_negative_anime:
-            continue
-            
-        # For each positive sample, create one negative sample
-        negative_samples = random.sample(potential_negative_anime, min(num_positive_samples, len(potential_negative_anime)))
-        
-        for anime_id in negative_samples:
-            anime_vector = feature_matrix[id_to_index[anime_id]]
-            combined_vector = np.concatenate([user_profile_vector, anime_vector])
-            X_data.append(combined_vector)
-            y_data.append(0.0) # Label for an unseen anime is 0
+        if potential_negative_anime.size:
+            # For each positive sample, create one negative sample
+            negative_samples = rng.choice(potential_negative_anime, size=min(num_positive_samples, potential_negative_anime.size), replace=False)
+            row_indices.extend(id_to_index[anime_id] for anime_id in negative_samples.tolist())
+            labels.extend([0.0] * len(negative_samples)) # Label for an unseen anime is 0
+
+        user_samples.append((user_profile_vector, np.asarray(row_indices, dtype=np.int64), labels))
             
     connection.close()
     
-    # Convert lists to NumPy arrays
-    X_train = np.array(X_data)
-    y_train = np.array(y_data)
+    # Pass 2: preallocate the final arrays and fill each user's block with slices
+    num_features = feature_matrix.shape[1]
+    total_rows = sum(len(row_indices) for _, row_indices, _ in user_samples)
+    X_train = np.empty((total_rows, 2 * num_features), dtype=feature_matrix.dtype)
+    y_train = np.empty(total_rows)
+    offset = 0
+    for user_profile_vector, row_indices, labels in user_samples:
+        end = offset + len(row_indices)
+        X_train[offset:end, :num_features] = user_profile_vector
+        X_train[offset:end, num_features:] = feature_matrix[row_indices]
+        y_train[offset:end] = labels
+        offset = end
 
     # Save the final dataset to files
     np.save('training_features.npy', X_train)
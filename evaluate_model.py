@@ -1,11 +1,9 @@
 import os
 import psycopg2
-import psycopg2.extras
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
-import random
-from sklearn.metrics.pairwise import cosine_similarity
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
 # --- 1. SETUP & DATABASE CONNECTION ---
@@ -27,7 +25,8 @@ def load_anime_features():
     """Loads the pre-computed feature matrix and anime ID mapping."""
     print("Loading pre-computed anime features...")
     try:
-        feature_matrix = np.load('anime_feature_matrix.npy')
+        # Memory-mapped, so joblib workers share one file mapping.
+        feature_matrix = np.load('anime_feature_matrix.npy', mmap_mode='r')
         anime_ids_df = pd.read_json('anime_ids.json', typ='series')
         
         # Create a mapping from anime_id to its row index in the matrix for fast lookups
@@ -39,64 +38,74 @@ def load_anime_features():
         print("ERROR: Feature files not found. Please run 'feature_engineering.py' first.")
         return None, None
 
-def get_user_watchlists(cursor):
+def get_user_watchlists(connection):
     """Fetches user watchlists with ranks to use as our 'ground truth' for testing."""
     print("Loading user watchlists from database...")
     # We now fetch the user_rank to use for weighted profiling
     query = "SELECT user_id, anime_id, user_rank FROM user_watchlists WHERE user_rank <= 50"
     
-    cursor.execute(query)
-    
-    user_data = {}
-    for user_id, anime_id, user_rank in cursor.fetchall():
-        if user_id not in user_data:
-            user_data[user_id] = []
-        user_data[user_id].append({'anime_id': anime_id, 'rank': user_rank})
+    with connection.cursor(name='watchlist_stream') as cursor:
+        cursor.itersize = 50000
+        cursor.execute(query)
+        user_data = {}
+        for user_id, anime_id, user_rank in cursor:
+            anime_ids, ranks = user_data.setdefault(user_id, ([], []))
+            anime_ids.append(anime_id)
+            ranks.append(user_rank)
+    # Each watchlist is kept as two parallel arrays: anime ids and ranks.
+    user_data = {user_id: (np.array(anime_ids, dtype=np.int64), np.array(ranks, dtype=float)) for user_id, (anime_ids, ranks) in user_data.items()}
     print(f"Loaded watchlists for {len(user_data)} users.")
     return user_data
 
 # --- 3. MODEL & EVALUATION LOGIC ---
 
-def build_user_profile_weighted(training_items, feature_matrix, id_to_index):
+def build_user_profile_weighted(rows, ranks, feature_matrix):
     """
     Creates a user's taste profile using a weighted average of their liked anime,
     giving more importance to higher-ranked items.
     """
-    weighted_vectors = []
-    total_weight = 0
-    
-    for item in training_items:
-        anime_id = item['anime_id']
-        rank = item['rank']
-        
-        if anime_id in id_to_index:
-            # Weighting function: higher rank (lower number) gets much more weight.
-            # We use log to make the drop-off less extreme.
-            weight = 1.0 / np.log(rank + 1.1) # Add 1.1 to avoid log(1)=0 and log of numbers < 1
-            
-            idx = id_to_index[anime_id]
-            weighted_vectors.append(feature_matrix[idx] * weight)
-            total_weight += weight
-            
-    if not weighted_vectors or total_weight == 0:
+    # rows are feature-matrix row indices of the anime (already translated from anime ids)
+    if rows.size == 0:
         return None
-        
-    # The final profile is the sum of weighted vectors divided by the sum of weights
-    profile_vector = np.sum(weighted_vectors, axis=0) / total_weight
+
+    # Weighting function: higher rank (lower number) gets much more weight.
+    # We use log to make the drop-off less extreme.
+    weights = 1.0 / np.log(ranks + 1.1) # Add 1.1 to avoid log(1)=0 and log of numbers < 1
+    total_weight = weights.sum()
+    if total_weight == 0:
+        return None
+
+    # The final profile is the sum of weighted vectors divided by the sum of weights (one gemv)
+    profile_vector = weights @ feature_matrix[rows] / total_weight
     return profile_vector
 
-def generate_recommendations(user_profile, feature_matrix, id_to_index, seen_anime_ids, num_recs=100):
+def normalize_rows(matrix):
+    """L2-normalizes every row once, so cosine similarity against it is a plain dot product."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def generate_recommendations(user_profile, normalized_matrix, candidate_ids, candidate_rows, seen_rows, num_recs=100):
     """Generates recommendations by finding the most similar anime vectors."""
-    user_profile = user_profile.reshape(1, -1)
-    sim_scores = cosine_similarity(user_profile, feature_matrix)[0]
-    
-    scored_anime = []
-    for anime_id, index in id_to_index.items():
-        if anime_id not in seen_anime_ids:
-            scored_anime.append((anime_id, sim_scores[index]))
-            
-    scored_anime.sort(key=lambda x: x[1], reverse=True)
-    return [anime_id for anime_id, score in scored_anime[:num_recs]]
+    # normalized_matrix comes from normalize_rows(), so only the profile is normalized per user.
+    profile_norm = np.linalg.norm(user_profile)
+    sim_scores = normalized_matrix @ (user_profile / profile_norm if profile_norm else user_profile)
+
+    # Scores in id_to_index order (candidate_ids/candidate_rows), with seen rows masked out by a boolean scatter.
+    unseen_rows = np.ones(len(sim_scores), dtype=bool)
+    unseen_rows[seen_rows] = False
+    unseen = unseen_rows[candidate_rows]
+    candidate_ids, scores = candidate_ids[unseen], sim_scores[candidate_rows[unseen]]
+
+    # partition finds the num_recs-th best score in O(N); only rows at or above it are sorted.
+    # The stable sort keeps ties in id_to_index order.
+    if num_recs < len(scores):
+        threshold = np.partition(scores, len(scores) - num_recs)[len(scores) - num_recs]
+        top = np.flatnonzero(scores >= threshold)
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind='stable')][:num_recs]
+    return candidate_ids[top].tolist()
 
 def calculate_precision_at_k(recommended_items, hold_out_items, k):
     """Calculates Precision@k."""
@@ -105,6 +114,14 @@ def calculate_precision_at_k(recommended_items, hold_out_items, k):
     hits = len(top_k_recs.intersection(hold_out_set))
     return hits / k
 
+def evaluate_user(training_rows, training_ranks, hold_out_set_ids, feature_matrix, normalized_matrix, candidate_ids, candidate_rows, k):
+    """Builds one user's profile, recommends, and returns Precision@k (None if no profile could be built)."""
+    user_profile_vector = build_user_profile_weighted(training_rows, training_ranks, feature_matrix)
+    if user_profile_vector is None: return None
+
+    recommendations = generate_recommendations(user_profile_vector, normalized_matrix, candidate_ids, candidate_rows, training_rows, num_recs=k)
+    return calculate_precision_at_k(recommendations, hold_out_set_ids, k)
+
 # --- 4. MAIN EXECUTION ---
 
 def main():
@@ -112,36 +129,40 @@ def main():
     
     feature_matrix, id_to_index = load_anime_features()
     if feature_matrix is None: return
+    normalized_matrix = normalize_rows(feature_matrix)
 
     connection = get_db_connection()
     if not connection: return
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
     try:
-        all_users_data = get_user_watchlists(cursor)
-        total_precision = 0
-        evaluated_users = 0
-
-        print(f"\nStarting evaluation loop for {len(all_users_data)} users...")
-        for user_id, liked_anime in tqdm(all_users_data.items()):
-            if len(liked_anime) < 4: continue
-
-            random.shuffle(liked_anime)
-            split_index = int(0.75 * len(liked_anime))
-            training_set_items = liked_anime[:split_index]
-            hold_out_set_ids = [item['anime_id'] for item in liked_anime[split_index:]]
-
-            # --- MODIFIED: Use the new weighted profile function ---
-            user_profile_vector = build_user_profile_weighted(training_set_items, feature_matrix, id_to_index)
-
-            if user_profile_vector is None: continue
-
-            seen_ids = {item['anime_id'] for item in training_set_items}
-            recommendations = generate_recommendations(user_profile_vector, feature_matrix, id_to_index, seen_ids, num_recs=K)
-            precision = calculate_precision_at_k(recommendations, hold_out_set_ids, K)
-            
-            total_precision += precision
-            evaluated_users += 1
+        all_users_data = get_user_watchlists(connection)
+
+        # Anime ids are translated to feature-matrix rows here, once per user; the workers only ever see row indices.
+        candidate_ids, candidate_rows = id_to_index.index.to_numpy(), id_to_index.to_numpy()
+
+        # Splits are drawn serially from one generator; each is a numpy permutation of watchlist positions.
+        rng = np.random.default_rng()
+        user_splits = []
+        for user_id, (anime_ids, ranks) in all_users_data.items():
+            if len(anime_ids) < 4: continue
+            positions = id_to_index.index.get_indexer(anime_ids)
+            rows = np.where(positions >= 0, candidate_rows[positions], -1) # -1 = not in the feature matrix
+
+            order = rng.permutation(len(anime_ids))
+            split_index = int(0.75 * len(order))
+            training, hold_out = order[:split_index], order[split_index:]
+            known = rows[training] >= 0
+            user_splits.append((rows[training][known], ranks[training][known], anime_ids[hold_out].tolist()))
+
+        # Users are independent, so they are evaluated across all cores; joblib memmaps the matrices to the workers.
+        print(f"\nStarting evaluation loop for {len(user_splits)} users...")
+        precisions = Parallel(n_jobs=-1)(
+            delayed(evaluate_user)(training_rows, training_ranks, hold_out_set_ids, feature_matrix, normalized_matrix, candidate_ids, candidate_rows, K)
+            for training_rows, training_ranks, hold_out_set_ids in tqdm(user_splits)
+        )
+        precisions = [precision for precision in precisions if precision is not None]
+        total_precision = sum(precisions)
+        evaluated_users = len(precisions)
 
         print("\n--- EVALUATION COMPLETE ---")
         if evaluated_users > 0:
@@ -154,7 +175,6 @@ def main():
 
     finally:
         if connection and not connection.closed:
-            cursor.close()
             connection.close()
             print("\nDatabase connection closed.")
 
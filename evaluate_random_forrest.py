@@ -1,15 +1,15 @@
 import os
 import psycopg2
-import psycopg2.extras
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
-import random
 import joblib
 from tqdm import tqdm
 
 # --- 1. SETUP & DATABASE CONNECTION ---
 load_dotenv()
+EVAL_BATCH_MB = 256 # Size of the float32 prediction buffer; users are batched so each model.predict call fits in it.
+
 def get_db_connection():
     try:
         ssl_mode = os.getenv('DB_SSLMODE', 'require')
@@ -39,15 +39,16 @@ def load_evaluation_assets():
         print("Please ensure 'random_forest_model.pkl' and other feature files exist.")
         return None, None, None
 
-def get_user_watchlists_for_test(cursor):
+def get_user_watchlists_for_test(connection):
     """Fetches user watchlists to use for the final hold-out test."""
     print("Loading user watchlists for final test...")
     query = "SELECT user_id, anime_id FROM user_watchlists WHERE user_rank <= 50"
-    cursor.execute(query)
-    user_data = {}
-    for user_id, anime_id in cursor.fetchall():
-        if user_id not in user_data: user_data[user_id] = []
-        user_data[user_id].append(anime_id)
+    with connection.cursor(name='watchlist_stream') as cursor:
+        cursor.itersize = 50000
+        cursor.execute(query)
+        user_data = {}
+        for user_id, anime_id in cursor:
+            user_data.setdefault(user_id, []).append(anime_id)
     print(f"Loaded test watchlists for {len(user_data)} users.")
     return user_data
 
@@ -59,6 +60,23 @@ def calculate_precision_at_k(recommended_items, hold_out_items, k):
     hits = len(top_k_recs.intersection(hold_out_set))
     return hits / k
 
+def evaluate_user_batch(model, pending_users, all_ids, prediction_buffer, k):
+    """Scores every anime for a batch of users with one model.predict call and returns each user's Precision@k."""
+    num_users, num_anime = len(pending_users), len(all_ids)
+    profiles = np.array([profile for _, _, profile in pending_users])
+    rows = prediction_buffer[:num_users * num_anime]
+    # The anime half of the buffer is filled once up front; only the user half changes per batch.
+    rows.reshape(num_users, num_anime, -1)[:, :, :profiles.shape[1]] = profiles[:, None, :]
+    all_scores = model.predict(rows).reshape(num_users, num_anime)
+
+    precisions = []
+    for (training_set_ids, hold_out_set_ids, _), scores in zip(pending_users, all_scores):
+        # Boolean mask over the shared id array.
+        unseen = ~np.isin(all_ids, training_set_ids)
+        ranked_recommendations = all_ids[unseen][np.argsort(-scores[unseen], kind='stable')].tolist()
+        precisions.append(calculate_precision_at_k(ranked_recommendations, hold_out_set_ids, k))
+    return precisions
+
 # --- 4. MAIN EXECUTION ---
 def main():
     K = 20  # We will measure Precision@20
@@ -73,46 +91,50 @@ def main():
     print("\n--- Starting Recommendation Ranking Evaluation (Precision@20) ---")
     connection = get_db_connection()
     if not connection: return
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        test_users = get_user_watchlists_for_test(cursor)
+        test_users = get_user_watchlists_for_test(connection)
         total_precision = 0
         evaluated_users = 0
 
+        # Every user is scored against every anime (seen ones are dropped when ranking), in float32 like the trees.
+        all_ids, all_rows = id_to_index.index.to_numpy(), id_to_index.to_numpy()
+        num_anime, num_features = len(all_ids), anime_feature_matrix.shape[1]
+        user_bytes = num_anime * 2 * num_features * np.dtype(np.float32).itemsize
+        users_per_batch = max(1, int(EVAL_BATCH_MB * 1024 ** 2) // user_bytes)
+        prediction_buffer = np.empty((users_per_batch * num_anime, 2 * num_features), dtype=np.float32)
+        prediction_buffer.reshape(users_per_batch, num_anime, -1)[:, :, num_features:] = anime_feature_matrix[all_rows]
+        pending_users = [] # (training_set_ids, hold_out_set_ids, user_profile_vector)
+        rng = np.random.default_rng()
+
         print(f"\nStarting ranking evaluation on a sample of {len(test_users)} users...")
         for user_id, liked_anime in tqdm(test_users.items()):
             if len(liked_anime) < 4: continue
 
-            random.shuffle(liked_anime)
+            # The train/hold-out split is a numpy permutation of the watchlist.
+            liked_anime = np.array(liked_anime, dtype=np.int64)
+            order = rng.permutation(len(liked_anime))
             split_index = int(0.75 * len(liked_anime))
-            training_set_ids = liked_anime[:split_index]
-            hold_out_set_ids = set(liked_anime[split_index:])
-
-            # Build this user's profile from their "training" items
-            liked_vectors = [anime_feature_matrix[id_to_index[anime_id]] for anime_id in training_set_ids if anime_id in id_to_index]
-            if not liked_vectors: continue
-            user_profile_vector = np.mean(liked_vectors, axis=0)
-
-            # Generate recommendations
-            unseen_anime_ids = list(set(id_to_index.index) - set(training_set_ids))
-            
-            prediction_data = []
-            for anime_id in unseen_anime_ids:
-                anime_vector = anime_feature_matrix[id_to_index[anime_id]]
-                combined_vector = np.concatenate([user_profile_vector, anime_vector])
-                prediction_data.append(combined_vector)
-            
-            # Use the loaded model to predict scores
-            predicted_scores = rf_regressor.predict(np.array(prediction_data))
-            
-            recommendations_with_scores = sorted(zip(unseen_anime_ids, predicted_scores), key=lambda x: x[1], reverse=True)
-            ranked_recommendations = [anime_id for anime_id, score in recommendations_with_scores]
-
-            # Calculate Precision@K
-            precision = calculate_precision_at_k(ranked_recommendations, hold_out_set_ids, K)
-            total_precision += precision
-            evaluated_users += 1
+            training_set_ids = liked_anime[order[:split_index]]
+            hold_out_set_ids = set(liked_anime[order[split_index:]].tolist())
+
+            # Build this user's profile from their "training" items (one vectorised id lookup, -1 = unknown)
+            positions = id_to_index.index.get_indexer(training_set_ids)
+            positions = positions[positions >= 0]
+            if positions.size == 0: continue
+            user_profile_vector = anime_feature_matrix[all_rows[positions]].mean(axis=0)
+
+            pending_users.append((training_set_ids, hold_out_set_ids, user_profile_vector))
+            if len(pending_users) == users_per_batch:
+                precisions = evaluate_user_batch(rf_regressor, pending_users, all_ids, prediction_buffer, K)
+                total_precision += sum(precisions)
+                evaluated_users += len(precisions)
+                pending_users = []
+
+        if pending_users:
+            precisions = evaluate_user_batch(rf_regressor, pending_users, all_ids, prediction_buffer, K)
+            total_precision += sum(precisions)
+            evaluated_users += len(precisions)
 
         print("\n--- EVALUATION COMPLETE ---")
         if evaluated_users > 0:
@@ -125,7 +147,6 @@ def main():
 
     finally:
         if connection and not connection.closed:
-            cursor.close()
             connection.close()
             print("\nDatabase connection closed.")
 
@@ -6,6 +6,7 @@ import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import MultiLabelBinarizer, StandardScaler
 from sentence_transformers import SentenceTransformer
+import torch
 import numpy as np
 import joblib
 from tqdm import tqdm
@@ -51,7 +52,15 @@ def load_anime_data(connection):
         LEFT JOIN genres g ON ag.genre_id = g.genre_id
         GROUP BY a.anime_id
     """
-    df = pd.read_sql_query(query, connection)
+    # Every row is needed for the DataFrame; the named cursor only keeps libpq from also holding the
+    # whole result at once, since it delivers the rows in batches of itersize.
+    with connection.cursor(name='anime_stream') as cursor:
+        cursor.itersize = 5000
+        cursor.execute(query)
+        rows = list(cursor)
+        columns = [column.name for column in cursor.description]
+    # coerce_float matches read_sql_query, so column dtypes are unchanged.
+    df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
     print(f"Loaded {len(df)} anime records.")
     return df
 
@@ -81,16 +90,20 @@ def create_studio_features(df):
 
 def create_synopsis_embeddings(df):
     print("\nStarting synopsis embedding generation...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    # Encode on the GPU when one is available (same fp32 weights as on the CPU), in batches of 256.
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+    print(f"Encoding synopses on {device}...")
     synopses = df['synopsis'].fillna('No synopsis available.').tolist()
-    embedding_matrix = model.encode(synopses, show_progress_bar=True)
+    embedding_matrix = model.encode(synopses, batch_size=256, show_progress_bar=True, convert_to_numpy=True)
     return embedding_matrix
 
 # --- NEW: Function to process numerical features ---
 def create_numerical_features(df):
     print("\nProcessing numerical features (score, rank)...")
-    # Select the numerical columns and fill any missing values with the median
-    numerical_df = df[['mean_score', 'overal_rank']].fillna(df[['mean_score', 'overal_rank']].median())
+    # Select the numerical columns once and fill any missing values with their median
+    numerical_df = df[['mean_score', 'overal_rank']]
+    numerical_df = numerical_df.fillna(numerical_df.median())
     scaler = StandardScaler()
     numerical_matrix = scaler.fit_transform(numerical_df)
     joblib.dump(scaler, 'scaler_numerical.pkl')
@@ -119,6 +132,8 @@ if __name__ == "__main__":
             synopsis_features * FEATURE_WEIGHTS['synopsis'],
             numerical_features * FEATURE_WEIGHTS['numerical'] # --- NEW ---
         ])
+        # Stored as C-contiguous float32: row reads are contiguous, and the trees predict on float32 anyway.
+        final_feature_matrix = np.ascontiguousarray(final_feature_matrix, dtype=np.float32)
         
         np.save('anime_feature_matrix.npy', final_feature_matrix)
         anime_df.to_pickle('anime_dataframe.pkl') # Save the whole dataframe for interaction features
@@ -2,13 +2,14 @@ import os
 import mysql.connector
 from dotenv import load_dotenv
 import argparse
-import json
-from collections import Counter
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
+from scipy.sparse import csr_matrix
+from json_utils import dumps_json, loads_json
 
 # --- 1. SETUP ---
 load_dotenv()
+PROFILE_PAGE_SIZE = 1000
+PROFILE_MATRIX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'taste_profiles.npz') # also written by batch_process_user_profiles.py, which imports the cache helpers below
 
 
 # --- 2. DATABASE CONNECTION ---
@@ -29,12 +30,6 @@ def get_db_connection():
 
 # --- 3. CORE RECOMMENDATION LOGIC ---
 
-def calculate_derived_rating(rank):
-    """Converts a user's rank into a weighted score."""
-    if rank is None or rank == 0:
-        return 0
-    return (1 / rank) * 10
-
 def get_or_create_user_taste_profile(cursor, user_id):
     """
     Fetches a user's taste profile from the DB. If it doesn't exist,
@@ -45,100 +40,214 @@ def get_or_create_user_taste_profile(cursor, user_id):
     
     if result:
         print(f"Found existing taste profile for user {user_id}.")
-        return json.loads(result[0])
+        return loads_json(result[0])
 
     print(f"No profile found for user {user_id}. Calculating a new one...")
     
-    # Fetch user's ranked anime
+    # Sum each keyword's signed derived rating, (1 / rank) * 10 (0 for rank 0), in MySQL via anime_keywords
+    # (see mysql_migrations.sql), so only the per-keyword sums come back.
     # IMPORTANT: This assumes you have a table with user rankings.
     # We will use 'user_watchlists' and its 'user_rank' column as an example.
     cursor.execute("""
-        SELECT uw.anime_id, uw.user_rank, a.positive_keywords, a.negative_keywords
+        SELECT ak.keyword, SUM(ak.sign * CASE WHEN uw.user_rank = 0 THEN 0 ELSE 1e0 / uw.user_rank * 10 END)
         FROM user_watchlists uw
-        JOIN animes a ON uw.anime_id = a.anime_id
+        JOIN anime_keywords ak ON uw.anime_id = ak.anime_id
         WHERE uw.user_id = %s AND uw.user_rank IS NOT NULL
+        GROUP BY ak.keyword
     """, (user_id,))
     
-    ranked_anime = cursor.fetchall()
+    taste_profile = dict(cursor.fetchall())
     
-    if not ranked_anime:
-        print(f"User {user_id} has no ranked anime to build a profile from.")
+    if not taste_profile:
+        print(f"User {user_id} has no ranked anime with keywords to build a profile from.")
         return {}
 
-    taste_profile = Counter()
-
-    for anime_id, rank, pos_keys, neg_keys in ranked_anime:
-        derived_rating = calculate_derived_rating(rank)
-        
-        if pos_keys:
-            for keyword in pos_keys.split(', '):
-                taste_profile[keyword] += derived_rating
-        if neg_keys:
-            for keyword in neg_keys.split(', '):
-                taste_profile[keyword] -= derived_rating
-
     # Save the newly created profile to the database
-    profile_json = json.dumps(dict(taste_profile))
+    profile_json = dumps_json(taste_profile)
+    version_before = profiles_version(cursor)
     cursor.execute("""
         INSERT INTO user_taste_profiles (user_id, taste_profile)
         VALUES (%s, %s)
         ON DUPLICATE KEY UPDATE taste_profile = VALUES(taste_profile)
     """, (user_id, profile_json))
+
+    # The new profile is appended to the cached matrix as one row only if that matrix was current and this
+    # INSERT is the table's only change since (one more row, and it holds the latest updated_at). Read in one
+    # statement so the checks see the same snapshot; anything else, e.g. another writer, rebuilds the cache.
+    cursor.execute("""
+        SELECT COUNT(*), MAX(updated_at), MAX(CASE WHEN user_id = %s THEN updated_at END)
+        FROM user_taste_profiles
+    """, (user_id,))
+    profile_count, last_update, row_update = cursor.fetchone()
+    version_after = f"{profile_count}:{last_update}"
+    cache = load_profile_matrix(version_before)
+    if (cache is not None and user_id not in cache['user_ids']
+            and profile_count == int(version_before.split(':')[0]) + 1 and last_update == row_update):
+        save_profile_matrix(append_profile_row(cache, user_id, taste_profile), version_after)
+    else:
+        build_profile_matrix(cursor, version_after)
     
     print(f"Successfully created and saved profile for user {user_id}.")
-    return dict(taste_profile)
-
-def find_taste_neighbors(cursor, target_user_id, target_profile, num_neighbors=50):
-    """Finds users with the most similar taste profiles using cosine similarity."""
-    cursor.execute("SELECT user_id, taste_profile FROM user_taste_profiles WHERE user_id != %s", (target_user_id,))
-    other_users = cursor.fetchall()
-
-    if not other_users:
-        return []
+    return taste_profile
 
-    # Prepare data for vectorization
-    other_profiles = [json.loads(profile) for _, profile in other_users]
-    other_user_ids = [user_id for user_id, _ in other_users]
+def profiles_version(cursor):
+    """
+    Identifies the current contents of user_taste_profiles by its row count and latest updated_at
+    (see mysql_migrations.sql); the cached matrix records the version it was built from.
+    """
+    cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM user_taste_profiles")
+    profile_count, last_update = cursor.fetchone()
+    return f"{profile_count}:{last_update}"
 
-    # Use pandas to create a feature matrix (keyword vectors)
-    df = pd.DataFrame(other_profiles).fillna(0)
-    target_df = pd.DataFrame([target_profile]).fillna(0)
+def load_profile_matrix(version):
+    """Loads the cached keyword matrix of every taste profile, or None if it is missing or not built from this version."""
+    try:
+        with np.load(PROFILE_MATRIX_PATH) as cached:
+            if 'version' not in cached.files or str(cached['version']) != version:
+                print("Cached taste-profile matrix is out of date; reading profiles from the database.")
+                return None
+            return {name: cached[name] for name in cached.files}
+    except FileNotFoundError:
+        return None
 
-    # Align columns so both dataframes have the same "universe" of keywords
-    all_columns = df.columns.union(target_df.columns)
-    df = df.reindex(columns=all_columns, fill_value=0)
-    target_df = target_df.reindex(columns=all_columns, fill_value=0)
+def save_profile_matrix(cache, version):
+    """Writes the cached matrix under a temporary name first, so readers never see a partial file. Returns whether it was written."""
+    temp_path = f"{PROFILE_MATRIX_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            np.savez(f, version=np.array(version), **{name: array for name, array in cache.items() if name != 'version'})
+        os.replace(temp_path, PROFILE_MATRIX_PATH)
+        return True
+    except OSError as err:
+        print(f"Could not write '{PROFILE_MATRIX_PATH}': {err}")
+        return False
+
+def append_profile_row(cache, user_id, profile):
+    """Adds one profile to the cached matrix as a new unit-normalized row, extending the vocabulary with its new keywords."""
+    vocab = cache['vocab'].tolist()
+    columns = {keyword: column for column, keyword in enumerate(vocab)}
+    for keyword in profile:
+        if keyword not in columns:
+            columns[keyword] = len(vocab)
+            vocab.append(keyword)
+
+    values = np.fromiter(profile.values(), dtype=float, count=len(profile))
+    norm = np.linalg.norm(values)
+    row_data = values / norm if norm > 0 else np.zeros(len(values))
+    row_indices = np.fromiter((columns[keyword] for keyword in profile), dtype=np.int32, count=len(profile))
+    return {
+        'data': np.concatenate((cache['data'], row_data.astype(np.float32))),
+        'indices': np.concatenate((cache['indices'], row_indices)),
+        'indptr': np.append(cache['indptr'], cache['indptr'][-1] + len(profile)),
+        'user_ids': np.append(cache['user_ids'], user_id),
+        'vocab': np.array(vocab, dtype=str)
+    }
+
+def unit_rows(data, indptr):
+    """
+    Scales each row of CSR data to unit length (all-zero rows stay zero) as the cache's float32 values.
+    Rows are stored unit-normalized, so a cosine similarity against them is a single dot product.
+    """
+    row_count = len(indptr) - 1
+    rows = np.repeat(np.arange(row_count), np.diff(indptr))
+    row_norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=row_count))[rows]
+    return np.divide(data, row_norms, out=np.zeros(len(data)), where=row_norms > 0).astype(np.float32)
+
+def build_profile_matrix(cursor, version):
+    """Decodes every stored taste profile once and rewrites the cached keyword matrix from them."""
+    print("Rebuilding the cached taste-profile matrix from the database...")
+    cursor.execute("SELECT user_id, taste_profile FROM user_taste_profiles")
+    # Sparse keyword vectors over one shared keyword -> column vocabulary, in the batch job's CSR layout
+    vocabulary = {}
+    user_ids, data, indices, indptr = [], [], [], [0]
+    for user_id, profile in cursor.fetchall():
+        user_ids.append(user_id)
+        for keyword, score in loads_json(profile).items():
+            indices.append(vocabulary.setdefault(keyword, len(vocabulary)))
+            data.append(score)
+        indptr.append(len(indices))
+
+    indptr = np.array(indptr)
+    cache = {
+        'data': unit_rows(np.array(data, dtype=float), indptr),
+        'indices': np.array(indices, dtype=np.int32), 'indptr': indptr,
+        'user_ids': np.array(user_ids), 'vocab': np.array(list(vocabulary), dtype=str)
+    }
+    save_profile_matrix(cache, version)
+    return cache
+
+def taste_similarities(cache, target_user_id, target_profile):
+    """Cosine similarity of the target profile to every other cached profile, as (user_ids, sims)."""
+    user_ids, vocab = cache['user_ids'], cache['vocab'].tolist()
+    keyword_matrix = csr_matrix((cache['data'], cache['indices'], cache['indptr']), shape=(len(user_ids), len(vocab)))
+
+    # Keywords no other user has only add to the target's norm, never to a dot product.
+    columns = {keyword: column for column, keyword in enumerate(vocab)}
+    target = np.zeros(len(vocab))
+    for keyword, score in target_profile.items():
+        if keyword in columns:
+            target[columns[keyword]] = score
+    target_norm = np.linalg.norm(np.fromiter(target_profile.values(), dtype=float))
+    if target_norm > 0:
+        target /= target_norm
+
+    # The cached rows are already unit-normalized, so one sparse matrix-vector product gives every cosine similarity
+    sims = keyword_matrix @ target
+    others = user_ids != target_user_id
+    return user_ids[others].tolist(), sims[others]
 
-    # Calculate cosine similarity
-    similarities = cosine_similarity(target_df, df)
+def find_taste_neighbors(cursor, target_user_id, target_profile, num_neighbors=50):
+    """Finds users with the most similar taste profiles using cosine similarity."""
+    # Profiles are matched against the cached sparse matrix (batch job or build_profile_matrix), never decoded here;
+    # it is rebuilt once whenever user_taste_profiles has changed since the cached version.
+    version = profiles_version(cursor)
+    cache = load_profile_matrix(version)
+    if cache is None:
+        cache = build_profile_matrix(cursor, version)
+
+    other_user_ids, sims = taste_similarities(cache, target_user_id, target_profile)
+    if not other_user_ids:
+        return []
     
-    # Get the top N neighbors
-    neighbor_indices = similarities[0].argsort()[-num_neighbors:][::-1]
+    # Get the top N neighbors: argpartition picks them in O(U), then only those N are sorted
+    neighbor_indices = np.argpartition(sims, -num_neighbors)[-num_neighbors:] if len(sims) > num_neighbors else np.arange(len(sims))
+    neighbor_indices = neighbor_indices[np.argsort(sims[neighbor_indices])[::-1]]
     return [other_user_ids[i] for i in neighbor_indices]
 
-def score_candidates(cursor, user_profile, candidate_ids):
-    """Scores candidate anime based on the user's taste profile."""
+def score_candidates(cursor, user_profile, candidate_ids, num_recs=10):
+    """Scores candidate anime based on the user's taste profile and returns the top num_recs (anime_id, title, score) rows."""
     if not candidate_ids:
-        return {}
+        return []
 
+    # The profile is uploaded to a temporary table so MySQL sums each candidate's keyword weights
+    # (anime_keywords, see mysql_migrations.sql) and only the top rows come back.
+    # Negative keywords already carry negative weights in the profile, so every matching keyword is simply added.
+    cursor.execute("""
+        CREATE TEMPORARY TABLE tmp_profile (
+            keyword VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin PRIMARY KEY,
+            weight DOUBLE NOT NULL
+        )
+    """)
+    profile_rows = list(user_profile.items())
+    for start in range(0, len(profile_rows), PROFILE_PAGE_SIZE):
+        cursor.executemany("INSERT INTO tmp_profile (keyword, weight) VALUES (%s, %s)", profile_rows[start:start + PROFILE_PAGE_SIZE])
+
+    # LEFT JOINs keep candidates without matching keywords at a score of 0.
+    # Titles come back with the scores (anime_id is the key), so no separate title lookup is needed.
     query_placeholders = ','.join(['%s'] * len(candidate_ids))
     cursor.execute(f"""
-        SELECT anime_id, positive_keywords, negative_keywords
-        FROM animes
-        WHERE anime_id IN ({query_placeholders})
-    """, tuple(candidate_ids))
-    
-    scored_candidates = {}
-    for anime_id, pos_keys, neg_keys in cursor.fetchall():
-        score = 0
-        if pos_keys:
-            for keyword in pos_keys.split(', '):
-                score += user_profile.get(keyword, 0)
-        if neg_keys:
-            for keyword in neg_keys.split(', '):
-                score += user_profile.get(keyword, 0) # Add the negative score
-        scored_candidates[anime_id] = score
-        
+        SELECT a.anime_id, a.title, COALESCE(SUM(tp.weight), 0) AS score
+        FROM animes a
+        LEFT JOIN anime_keywords ak ON ak.anime_id = a.anime_id
+        LEFT JOIN tmp_profile tp ON tp.keyword = ak.keyword
+        WHERE a.anime_id IN ({query_placeholders})
+        GROUP BY a.anime_id
+        ORDER BY score DESC
+        LIMIT %s
+    """, (*candidate_ids, num_recs))
+    scored_candidates = cursor.fetchall()
+    cursor.execute("DROP TEMPORARY TABLE tmp_profile")
+
     return scored_candidates
 
 # --- 4. MAIN SCRIPT ---
@@ -180,19 +289,15 @@ def main():
         candidate_anime_ids = {item[0] for item in cursor.fetchall()} - user_seen_anime
         print(f"Generated {len(candidate_anime_ids)} candidate anime from neighbors.")
 
-        # 4. Score candidates based on content similarity to user's profile
-        scored_anime = score_candidates(cursor, taste_profile, list(candidate_anime_ids))
-        
-        # 5. Get top 10 recommendations and their titles
-        sorted_recommendations = sorted(scored_anime.items(), key=lambda item: item[1], reverse=True)[:10]
+        # 4. Score candidates based on content similarity to user's profile (top 10 with titles, ranked by MySQL)
+        sorted_recommendations = score_candidates(cursor, taste_profile, list(candidate_anime_ids), num_recs=10)
 
+        # 5. Print the top 10 recommendations
         print("\n--- TOP 10 RECOMMENDATIONS ---")
         if not sorted_recommendations:
             print("Could not generate any recommendations with the current data.")
         else:
-            for anime_id, score in sorted_recommendations:
-                cursor.execute("SELECT title FROM animes WHERE anime_id = %s", (anime_id,))
-                title = cursor.fetchone()[0]
+            for anime_id, title, score in sorted_recommendations:
                 print(f"  - {title} (Score: {score:.2f})")
 
     except mysql.connector.Error as err:
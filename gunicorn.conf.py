@@ -0,0 +1,17 @@
+import os
+
+# Gunicorn settings for api.py (used by the Procfile). Override with environment variables.
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', 4))
+# gthread by default; set WEB_WORKER_CLASS=gevent (needs gevent + psycogreen) for many concurrent DB-bound requests.
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', 8))
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', 1000))
+# Preloading shares the model between workers, but gevent has to patch before api.py is imported.
+preload_app = worker_class != 'gevent'
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # Lets psycopg2 yield to other greenlets while waiting on Postgres.
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,11 @@
+import json
+try:
+    import orjson  # Optional: faster JSON (de)serialization when installed (pip install orjson)
+except ImportError:
+    orjson = None
+
+
+def dumps_json(obj):
+    return orjson.dumps(obj).decode() if orjson is not None else json.dumps(obj)
+
+loads_json = orjson.loads if orjson is not None else json.loads
@@ -0,0 +1,44 @@
+-- MySQL schema/index updates used by process_reviews.py and get_recommendations.py. Safe to re-run.
+
+-- animes.positive_keywords / negative_keywords normalised to one row per keyword (+1 positive, -1 negative),
+-- so taste profiles can be summed with GROUP BY. The animes columns remain the source of the keywords:
+-- process_reviews.py rewrites the rows of the anime it re-aggregates, and rebuilds the whole table with --reanalyze
+-- or while it is empty, so its first run after creating the table backfills every anime.
+-- keyword is binary-collated so keywords compare the same way as the Python dict keys they become.
+CREATE TABLE IF NOT EXISTS anime_keywords (
+    anime_id INT NOT NULL,
+    keyword VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    sign TINYINT NOT NULL,
+    PRIMARY KEY (anime_id, keyword, sign),
+    KEY anime_keywords_keyword_idx (keyword)
+);
+
+-- MySQL has no CREATE INDEX IF NOT EXISTS, so each index below is only created when information_schema lacks it.
+
+-- get_recommendations.py filters watchlists by user_id and user_rank (profile building, and neighbours' picks
+-- with user_id IN (...) AND user_rank <= 20); the composite index serves both without scanning each user's rows.
+SET @sql = IF((SELECT COUNT(*) FROM information_schema.statistics
+               WHERE table_schema = DATABASE() AND table_name = 'user_watchlists' AND index_name = 'user_watchlists_user_rank_idx') = 0,
+              'CREATE INDEX user_watchlists_user_rank_idx ON user_watchlists (user_id, user_rank)', 'DO 0');
+PREPARE stmt FROM @sql; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+-- process_reviews.py aggregates reviews per anime (GROUP BY anime_id, anime_id IN (...)).
+SET @sql = IF((SELECT COUNT(*) FROM information_schema.statistics
+               WHERE table_schema = DATABASE() AND table_name = 'reviews' AND index_name = 'reviews_anime_id_idx') = 0,
+              'CREATE INDEX reviews_anime_id_idx ON reviews (anime_id)', 'DO 0');
+PREPARE stmt FROM @sql; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+-- process_reviews.py only fetches reviews WHERE analyzed_at IS NULL unless --reanalyze is given.
+SET @sql = IF((SELECT COUNT(*) FROM information_schema.statistics
+               WHERE table_schema = DATABASE() AND table_name = 'reviews' AND index_name = 'reviews_analyzed_at_idx') = 0,
+              'CREATE INDEX reviews_analyzed_at_idx ON reviews (analyzed_at)', 'DO 0');
+PREPARE stmt FROM @sql; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+-- get_recommendations.py tags its cached profile matrix with COUNT(*) and MAX(updated_at) of user_taste_profiles,
+-- so any inserted, updated or deleted profile invalidates it. Microsecond precision keeps same-second updates apart.
+SET @sql = IF((SELECT COUNT(*) FROM information_schema.columns
+               WHERE table_schema = DATABASE() AND table_name = 'user_taste_profiles' AND column_name = 'updated_at') = 0,
+              'ALTER TABLE user_taste_profiles
+                   ADD COLUMN updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+                   ADD KEY user_taste_profiles_updated_at_idx (updated_at)', 'DO 0');
+PREPARE stmt FROM @sql; EXECUTE stmt; DEALLOCATE PREPARE stmt;
@@ -0,0 +1,12 @@
+-- Postgres schema/index updates used by api.py. Safe to re-run.
+
+-- Reviews are fetched per reel with anime_id = ANY(...).
+CREATE INDEX IF NOT EXISTS reviews_anime_id_idx ON reviews (anime_id);
+
+-- /api/feedback patches taste_profile in place with jsonb operators.
+ALTER TABLE user_taste_profiles ALTER COLUMN taste_profile TYPE jsonb USING taste_profile::jsonb;
+
+-- /api/search_anime matches titles with ILIKE '%q%'; pg_trgm GIN indexes serve that without a sequential scan.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS animes_title_trgm_idx ON animes USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS animes_title_english_trgm_idx ON animes USING gin (title_english gin_trgm_ops);
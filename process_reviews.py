@@ -3,15 +3,24 @@ import mysql.connector
 from dotenv import load_dotenv
 from textblob import TextBlob
 import spacy
-from collections import Counter
+from collections import Counter, defaultdict
+from functools import lru_cache
 import argparse
 
 # --- 1. SETUP ---
 load_dotenv()
-print("Loading spaCy model...")
-# Load the full model, keeping the parser which is essential for this new logic
-nlp = spacy.load("en_core_web_sm")
-print("Model loaded.")
+SENTIMENT_PAGE_SIZE = 1000
+SPACY_MAX_PROCESSES = os.cpu_count() or 1
+SPACY_REVIEWS_PER_PROCESS = 500 # each extra worker process loads its own copy of the model, so small runs parse in-process
+
+@lru_cache(maxsize=None)
+def load_nlp():
+    """Loads the spaCy model on first use; importing this module (as spawned worker processes do) doesn't load it."""
+    print("Loading spaCy model...")
+    # Keep the tagger and parser which are essential for this logic; NER is never used, so it is not loaded
+    nlp = spacy.load("en_core_web_sm", exclude=["ner"])
+    print("Model loaded.")
+    return nlp
 
 # --- 2. DATABASE CONNECTION ---
 def get_db_connection():
@@ -31,21 +40,19 @@ def get_db_connection():
         return None
 
 # --- 3. REBUILT CORE ANALYSIS LOGIC ---
-def analyze_review_aspects(text):
+@lru_cache(maxsize=20000)
+def word_polarity(word):
+    """TextBlob polarity of a single word, cached since the same adjectives and verbs recur across reviews."""
+    return TextBlob(word).sentiment.polarity
+
+def analyze_review_aspects(doc):
     """
-    Analyzes review text to extract praised and criticized aspects using
-    dependency parsing for higher accuracy.
+    Analyzes a parsed review Doc (from nlp.pipe) to extract praised and criticized
+    aspects using dependency parsing for higher accuracy.
     """
     positive_keywords = []
     negative_keywords = []
 
-    # Handle potentially very large text blocks from concatenated reviews
-    if len(text) > nlp.max_length:
-        print(f"Warning: Text length ({len(text)}) exceeds spaCy's max length ({nlp.max_length}). Truncating.")
-        text = text[:nlp.max_length]
-    
-    doc = nlp(text)
-
     # Pattern 1: Find adjectives describing nouns (e.g., "beautiful art")
     for token in doc:
         # Find adjectives that are not stop words
@@ -57,7 +64,7 @@ def analyze_review_aspects(text):
                 descriptor = token.text
                 
                 # Get sentiment of the adjective itself
-                polarity = TextBlob(descriptor).sentiment.polarity
+                polarity = word_polarity(descriptor)
                 
                 if polarity > 0.4:
                     positive_keywords.append(aspect.lower())
@@ -71,7 +78,7 @@ def analyze_review_aspects(text):
             verb = token.head
             if verb.pos_ == 'VERB':
                 # Get sentiment of the verb's base form (lemma)
-                polarity = TextBlob(verb.lemma_).sentiment.polarity
+                polarity = word_polarity(verb.lemma_)
                 if polarity > 0.5:
                     positive_keywords.append(token.text.lower())
                 elif polarity < -0.5:
@@ -88,12 +95,114 @@ def analyze_review_aspects(text):
 
     return positive_keywords, negative_keywords
 
+def split_keywords(keywords):
+    """Splits a ", "-joined keyword summary (animes.positive_keywords / negative_keywords) into its keywords."""
+    return list(dict.fromkeys(k for k in keywords.split(', ') if k)) if keywords else []
+
+def rebuild_anime_keywords(cursor, anime_ids=None):
+    """
+    Rewrites the anime_keywords rows (see mysql_migrations.sql) of the given anime (the whole table when
+    anime_ids is None) from the keyword summaries in animes, which stay the only source of the keywords;
+    the table is a derived, indexable copy of them. Returns how many keyword rows were written. The caller commits.
+    """
+    if anime_ids is None:
+        cursor.execute("SELECT anime_id, positive_keywords, negative_keywords FROM animes")
+        anime_rows = cursor.fetchall()
+        cursor.execute("DELETE FROM anime_keywords")
+    else:
+        anime_rows = []
+        for start in range(0, len(anime_ids), SENTIMENT_PAGE_SIZE):
+            page = tuple(anime_ids[start:start + SENTIMENT_PAGE_SIZE])
+            placeholders = ','.join(['%s'] * len(page))
+            cursor.execute(f"SELECT anime_id, positive_keywords, negative_keywords FROM animes WHERE anime_id IN ({placeholders})", page)
+            anime_rows.extend(cursor.fetchall())
+            cursor.execute(f"DELETE FROM anime_keywords WHERE anime_id IN ({placeholders})", page)
+
+    keyword_rows = [] # (anime_id, keyword, sign)
+    for anime_id, pos_keys, neg_keys in anime_rows:
+        keyword_rows.extend((anime_id, keyword, 1) for keyword in split_keywords(pos_keys))
+        keyword_rows.extend((anime_id, keyword, -1) for keyword in split_keywords(neg_keys))
+
+    for start in range(0, len(keyword_rows), SENTIMENT_PAGE_SIZE):
+        cursor.executemany("INSERT INTO anime_keywords (anime_id, keyword, sign) VALUES (%s, %s, %s)", keyword_rows[start:start + SENTIMENT_PAGE_SIZE])
+    return len(keyword_rows)
+
+def aggregate_anime_reviews(cursor, anime_ids=None):
+    """
+    Updates the average sentiment and top keywords of the given anime (every anime when anime_ids is None)
+    and returns how many anime were aggregated. The caller commits.
+    """
+    print("\nAggregating results and updating anime table...")
+    anime_filter, anime_params = "", ()
+    if anime_ids is not None:
+        anime_filter = f" AND anime_id IN ({','.join(['%s'] * len(anime_ids))})"
+        anime_params = tuple(anime_ids)
+
+    # Two grouped reads: the average score per anime, then every review's text.
+    cursor.execute(f"SELECT anime_id, AVG(sentiment_polarity) FROM reviews WHERE anime_id IS NOT NULL{anime_filter} GROUP BY anime_id", anime_params)
+    avg_scores = cursor.fetchall()
+
+    cursor.execute(f"SELECT anime_id, review_text FROM reviews WHERE anime_id IS NOT NULL AND review_text IS NOT NULL{anime_filter}", anime_params)
+    review_texts = defaultdict(list)
+    for anime_id, review_text in cursor.fetchall():
+        review_texts[anime_id].append(review_text)
+
+    # Each review is parsed on its own and the keyword counts are merged per anime,
+    # so no text has to be truncated at nlp.max_length.
+    nlp = load_nlp()
+    analyzed_anime = [] # (anime_id, avg_score) for anime with review text
+    review_items = [] # (anime_id, review_text)
+    for anime_id, avg_score in avg_scores:
+        texts = [text for text in review_texts.get(anime_id, []) if text.strip()]
+
+        if not texts:
+            print(f"No text to analyze for anime_id {anime_id}. Skipping keyword aggregation.")
+            continue
+        analyzed_anime.append((anime_id, avg_score))
+
+        for text in texts:
+            # Handle a single review longer than spaCy's limit
+            if len(text) > nlp.max_length:
+                print(f"Warning: Review length ({len(text)}) exceeds spaCy's max length ({nlp.max_length}). Truncating.")
+                text = text[:nlp.max_length]
+            review_items.append((anime_id, text))
+
+    # nlp.pipe parses the reviews in batches, with one worker process per SPACY_REVIEWS_PER_PROCESS reviews
+    # (at most SPACY_MAX_PROCESSES); small incremental runs stay in this process.
+    n_process = max(1, min(SPACY_MAX_PROCESSES, len(review_items) // SPACY_REVIEWS_PER_PROCESS))
+    docs = nlp.pipe((text for _, text in review_items), batch_size=32, n_process=n_process)
+    positive_counts, negative_counts = defaultdict(Counter), defaultdict(Counter)
+    for (anime_id, _), doc in zip(review_items, docs):
+        pos_keys, neg_keys = analyze_review_aspects(doc)
+        positive_counts[anime_id].update(pos_keys)
+        negative_counts[anime_id].update(neg_keys)
+
+    for anime_id, avg_score in analyzed_anime:
+        top_positive = [word for word, count in positive_counts[anime_id].most_common(5)]
+        top_negative = [word for word, count in negative_counts[anime_id].most_common(5)]
+        positive_summary = ", ".join(top_positive)
+        negative_summary = ", ".join(top_negative)
+
+        update_anime_query = """
+            UPDATE animes
+            SET avg_sentiment_score = %s, positive_keywords = %s, negative_keywords = %s
+            WHERE anime_id = %s
+        """
+        cursor.execute(update_anime_query, (avg_score, positive_summary, negative_summary, anime_id))
+
+    return len(avg_scores)
+
 # --- 4. MAIN SCRIPT ---
 def main():
     """
     Main function to orchestrate the fetching, processing,
-    and updating of anime reviews. It will always re-process all reviews.
+    and updating of anime reviews. Only reviews that have not been analyzed yet
+    (and the anime they belong to) are processed, unless --reanalyze is given.
     """
+    parser = argparse.ArgumentParser(description="Analyze review sentiment and aggregate keywords per anime.")
+    parser.add_argument("--reanalyze", action="store_true", help="Re-process every review and anime, not just new reviews.")
+    args = parser.parse_args()
+
     connection = get_db_connection()
     if not connection:
         return
@@ -102,63 +211,75 @@ def main():
 
     try:
         # --- PART A: PROCESS INDIVIDUAL REVIEWS ---
-        # The script will now always fetch all reviews to re-process them.
-        print("\nFetching ALL reviews for re-analysis.")
-        fetch_query = "SELECT review_id, review_text FROM reviews"
+        # Reviews already stamped with analyzed_at are skipped, so a run only costs as much as the new reviews.
+        if args.reanalyze:
+            print("\nFetching ALL reviews for re-analysis.")
+            fetch_query = "SELECT review_id, anime_id, review_text FROM reviews"
+        else:
+            print("\nFetching reviews that have not been analyzed yet.")
+            fetch_query = "SELECT review_id, anime_id, review_text FROM reviews WHERE analyzed_at IS NULL"
         
         cursor.execute(fetch_query)
         unprocessed_reviews = cursor.fetchall()
+        changed_anime_ids = sorted({anime_id for _, anime_id, _ in unprocessed_reviews if anime_id is not None})
         
         if not unprocessed_reviews:
             print("\nNo reviews found in the database to process.")
         else:
             print(f"\nFound {len(unprocessed_reviews)} reviews to analyze.")
-            for i, (review_id, review_text) in enumerate(unprocessed_reviews):
-                if not review_text: continue
+            sentiments = []
+            empty_review_ids = [] # nothing to score, but still stamped as analyzed so they aren't fetched again
+            for i, (review_id, _, review_text) in enumerate(unprocessed_reviews):
+                if not review_text:
+                    empty_review_ids.append(review_id)
+                    continue
                 print(f"Processing review {i+1}/{len(unprocessed_reviews)} (ID: {review_id})...")
                 
-                blob = TextBlob(review_text)
-                update_query = """
-                    UPDATE reviews 
-                    SET sentiment_polarity = %s, sentiment_subjectivity = %s, analyzed_at = NOW()
-                    WHERE review_id = %s
-                """
-                cursor.execute(update_query, (blob.sentiment.polarity, blob.sentiment.subjectivity, review_id))
+                sentiment = TextBlob(review_text).sentiment
+                sentiments.append((review_id, sentiment.polarity, sentiment.subjectivity))
+
+            # Scores are staged with multi-row INSERTs (executemany batches them) and applied with one UPDATE ... JOIN.
+            # The staging table copies its column types from reviews (LIMIT 0 copies no rows).
+            cursor.execute("""
+                CREATE TEMPORARY TABLE review_sentiments (PRIMARY KEY (review_id))
+                SELECT review_id, sentiment_polarity, sentiment_subjectivity FROM reviews LIMIT 0
+            """)
+            for start in range(0, len(sentiments), SENTIMENT_PAGE_SIZE):
+                cursor.executemany("INSERT INTO review_sentiments VALUES (%s, %s, %s)", sentiments[start:start + SENTIMENT_PAGE_SIZE])
+            cursor.execute("""
+                UPDATE reviews r
+                JOIN review_sentiments s ON r.review_id = s.review_id
+                SET r.sentiment_polarity = s.sentiment_polarity, r.sentiment_subjectivity = s.sentiment_subjectivity, r.analyzed_at = NOW()
+            """)
+            cursor.execute("DROP TEMPORARY TABLE review_sentiments")
+            for start in range(0, len(empty_review_ids), SENTIMENT_PAGE_SIZE):
+                page = empty_review_ids[start:start + SENTIMENT_PAGE_SIZE]
+                cursor.execute(f"UPDATE reviews SET analyzed_at = NOW() WHERE review_id IN ({','.join(['%s'] * len(page))})", tuple(page))
 
             connection.commit()
             print(f"\nSuccessfully analyzed and updated {len(unprocessed_reviews)} individual reviews.")
 
         # --- PART B: AGGREGATE RESULTS FOR EACH ANIME ---
-        print("\nAggregating results and updating anime table...")
-        
-        cursor.execute("SELECT DISTINCT anime_id FROM reviews WHERE anime_id IS NOT NULL")
-        anime_ids = [item[0] for item in cursor.fetchall()]
-
-        for anime_id in anime_ids:
-            cursor.execute("SELECT AVG(sentiment_polarity) FROM reviews WHERE anime_id = %s", (anime_id,))
-            avg_score = cursor.fetchone()[0]
-
-            cursor.execute("SELECT review_text FROM reviews WHERE anime_id = %s and review_text IS NOT NULL", (anime_id,))
-            all_reviews_text = " ".join([row[0] for row in cursor.fetchall()])
-            
-            if not all_reviews_text.strip():
-                print(f"No text to analyze for anime_id {anime_id}. Skipping keyword aggregation.")
-                continue
-
-            pos_keys, neg_keys = analyze_review_aspects(all_reviews_text)
-            
-            positive_summary = ", ".join([word for word, count in Counter(pos_keys).most_common(5)])
-            negative_summary = ", ".join([word for word, count in Counter(neg_keys).most_common(5)])
-            
-            update_anime_query = """
-                UPDATE animes
-                SET avg_sentiment_score = %s, positive_keywords = %s, negative_keywords = %s
-                WHERE anime_id = %s
-            """
-            cursor.execute(update_anime_query, (avg_score, positive_summary, negative_summary, anime_id))
-
-        connection.commit()
-        print(f"Successfully aggregated data for {len(anime_ids)} animes.")
+        # Only anime that received newly analyzed reviews are re-aggregated (all of them with --reanalyze).
+        if args.reanalyze or changed_anime_ids:
+            aggregated_count = aggregate_anime_reviews(cursor, None if args.reanalyze else changed_anime_ids)
+            print(f"Successfully aggregated data for {aggregated_count} animes.")
+        else:
+            print("\nNo anime have new reviews; nothing to aggregate.")
+
+        # --- PART C: UPDATE anime_keywords ---
+        # Only the re-aggregated anime get their keyword rows rewritten. The whole table is rebuilt with --reanalyze,
+        # or while it is still empty, so anime analyzed before the table existed are backfilled on the first run.
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM anime_keywords)")
+        keywords_empty = not cursor.fetchone()[0]
+        if args.reanalyze or keywords_empty:
+            keyword_count = rebuild_anime_keywords(cursor)
+            connection.commit()
+            print(f"Rebuilt anime_keywords with {keyword_count} keyword rows.")
+        elif changed_anime_ids:
+            keyword_count = rebuild_anime_keywords(cursor, changed_anime_ids)
+            connection.commit()
+            print(f"Rewrote {keyword_count} anime_keywords rows for {len(changed_anime_ids)} animes.")
 
     except mysql.connector.Error as err:
         print(f"An error occurred: {err}")
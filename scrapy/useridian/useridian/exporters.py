@@ -0,0 +1,23 @@
+# Custom feed exporters, registered in FEED_EXPORTERS (settings.py)
+# See: https://docs.scrapy.org/en/latest/topics/exporters.html
+
+from scrapy.exporters import JsonLinesItemExporter
+
+try:
+    import orjson  # Optional: faster JSON lines feeds when installed (pip install orjson)
+except ImportError:
+    orjson = None
+
+
+class OrjsonLinesItemExporter(JsonLinesItemExporter):
+    """
+    JSON lines exporter that serializes items with orjson (a C extension),
+    which matters for animecrawl's long review_text strings. Types orjson doesn't know are handed
+    to Scrapy's own encoder; without orjson installed this is the stock exporter.
+    """
+
+    def export_item(self, item):
+        if orjson is None:
+            return super().export_item(item)
+        itemdict = dict(self._get_serialized_fields(item))
+        self.file.write(orjson.dumps(itemdict, default=self.encoder.default) + b"\n")
@@ -3,11 +3,102 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import time
+
+import mysql.connector
+from dotenv import load_dotenv
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
 
 class UseridianPipeline:
+    """
+    Writes animecrawl items straight to MySQL (same statements as import_anime+review_to_db.js).
+    Rows are buffered and flushed with executemany, one commit per flush, every FLUSH_ROWS items
+    or FLUSH_SECONDS. Items are passed on unchanged,
+    so feed exports keep working.
+
+    Off unless MYSQL_PIPELINE_ENABLED is set (scrapy crawl animecrawl -s MYSQL_PIPELINE_ENABLED=1),
+    so the CSV export + import_anime+review_to_db.js workflow still runs without MySQL.
+    A failed write stops the crawl; the unwritten rows are retried once when the spider closes.
+    """
+    FLUSH_ROWS = 500
+    FLUSH_SECONDS = 2
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.failed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('MYSQL_PIPELINE_ENABLED'):
+            raise NotConfigured("MYSQL_PIPELINE_ENABLED is not set")
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        load_dotenv()
+        self.connection = mysql.connector.connect(
+            host=os.getenv('DB_HOST'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            database=os.getenv('DB_NAME'),
+            connection_timeout=15
+        )
+        self.cursor = self.connection.cursor()
+        self.anime_rows = []  # (studio, promo_link, anime_id)
+        self.review_rows = []  # (anime_id, username, review_date, rating_score, review_text)
+        self.last_flush = time.monotonic()
+
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if adapter.get('type') == 'anime_details':
+            self.anime_rows.append((adapter.get('studio'), adapter.get('promo_video_url'), adapter['anime_id']))
+        elif adapter.get('type') == 'review':
+            try:
+                rating = int(adapter.get('rating_score'))
+            except (TypeError, ValueError):
+                rating = None
+            self.review_rows.append((adapter['anime_id'], adapter.get('username'), adapter.get('date'),
+                                     rating, adapter.get('review_text') or None))
+
+        if not self.failed and (len(self.anime_rows) + len(self.review_rows) >= self.FLUSH_ROWS
+                                or time.monotonic() - self.last_flush >= self.FLUSH_SECONDS):
+            try:
+                self.flush()
+            except mysql.connector.Error as err:
+                self.failed = True
+                spider.logger.error(f"MySQL write failed, closing the spider: {err}")
+                self.crawler.engine.close_spider(spider, 'mysql_error')
+                raise
         return item
+
+    def flush(self):
+        """Writes the buffered rows in one transaction; on error it rolls back, keeps the rows and re-raises."""
+        try:
+            if self.anime_rows:
+                self.cursor.executemany("UPDATE animes SET studio = %s, promo_link = %s WHERE anime_id = %s", self.anime_rows)
+            if self.review_rows:
+                # INSERT IGNORE skips reviews that were already inserted; executemany sends one multi-row INSERT
+                self.cursor.executemany("""
+                    INSERT IGNORE INTO reviews (anime_id, username, review_date, rating_score, review_text)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, self.review_rows)
+            self.connection.commit()
+        except mysql.connector.Error:
+            self.connection.rollback()
+            raise
+        self.anime_rows, self.review_rows = [], []
+        self.last_flush = time.monotonic()
+
+    def close_spider(self, spider):
+        try:
+            self.flush()
+        except mysql.connector.Error as err:
+            spider.logger.error(f"Could not write {len(self.anime_rows)} anime and {len(self.review_rows)} review rows to MySQL: {err}")
+            raise
+        finally:
+            self.cursor.close()
+            self.connection.close()
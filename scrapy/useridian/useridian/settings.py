@@ -62,6 +62,9 @@ DOWNLOAD_DELAY = 1
 #    "useridian.pipelines.UseridianPipeline": 300,
 #}
 
+# animecrawl's MySQL pipeline is opt-in: scrapy crawl animecrawl -s MYSQL_PIPELINE_ENABLED=1
+MYSQL_PIPELINE_ENABLED = False
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -85,3 +88,9 @@ DOWNLOAD_DELAY = 1
 
 # Set settings whose default value is deprecated to a future-proof value
 FEED_EXPORT_ENCODING = "utf-8"
+
+# JSON lines feeds (-o items.jsonl) are written with orjson when it is installed
+FEED_EXPORTERS = {
+    "jsonlines": "useridian.exporters.OrjsonLinesItemExporter",
+    "jsonl": "useridian.exporters.OrjsonLinesItemExporter",
+}
@@ -7,6 +7,11 @@ class AnimeCrawl(scrapy.Spider):
     allowed_domains = ["myanimelist.net"]
     REVIEW_PAGE_LIMIT = 5
 
+    # Details and reviews are written to MySQL in batches as they are scraped (see pipelines.py)
+    custom_settings = {
+        'ITEM_PIPELINES': {'useridian.pipelines.UseridianPipeline': 300},
+    }
+
     def start_requests(self):
         filename = 'D:/MAL/anime.csv'
         try:
@@ -1,5 +1,6 @@
 import scrapy
 import csv
+from itertools import dropwhile
 
 class TitleSpider(scrapy.Spider):
     # The name of the spider, used to run it from the command line.
@@ -15,34 +16,27 @@ class TitleSpider(scrapy.Spider):
         
         # The ID you want to start AFTER.
         start_after_id = '34213'
-        
-        # A flag to track when we should start scraping.
-        found_start_point = False
 
         try:
             with open(input_csv_path, mode='r', encoding='utf-8') as csvfile:
                 reader = csv.reader(csvfile)
                 next(reader) # Skip the header row (ID,TITLE,...)
                 
-                for row in reader:
+                # Skip every row up to and including our starting ID, then scrape all the rows after it
+                # (no per-row flag check once the start point is found).
+                rows = dropwhile(lambda row: row[0] != start_after_id, reader)
+                next(rows, None) # Consume the start row itself
+                
+                for row in rows:
                     anime_id = row[0]
+                    anime_url = f'https://myanimelist.net/anime/{anime_id}'
                     
-                    # If the flag is True, it means we have passed our starting ID
-                    # and should now process this row and all future rows.
-                    if found_start_point:
-                        anime_url = f'https://myanimelist.net/anime/{anime_id}'
-                        
-                        # Yield a request for the anime.
-                        yield scrapy.Request(
-                            url=anime_url,
-                            callback=self.parse,
-                            meta={'anime_id': anime_id}
-                        )
-
-                    # Check if the current row's ID is our target.
-                    # If it is, we set the flag to True so the *next* iteration starts scraping.
-                    if anime_id == start_after_id:
-                        found_start_point = True
+                    # Yield a request for the anime.
+                    yield scrapy.Request(
+                        url=anime_url,
+                        callback=self.parse,
+                        meta={'anime_id': anime_id}
+                    )
 
         except FileNotFoundError:
             self.logger.error(f"Input file not found: {input_csv_path}. Please ensure the path is correct.")
@@ -12,8 +12,15 @@ class MalSpider(scrapy.Spider):
     allowed_domains = ['myanimelist.net']
 
     # Add a User-Agent to avoid being blocked.
+    # Each user's list is one I/O-bound page fetch, so many are fetched in parallel;
+    # AutoThrottle backs off if MAL starts responding slowly.
     custom_settings = {
-        'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'CONCURRENT_REQUESTS': 32,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+        'DOWNLOAD_DELAY': 0.25,
+        'AUTOTHROTTLE_ENABLED': True,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': 16,
     }
 
     async def start(self):
@@ -15,9 +15,9 @@ class NewspiderSpider(scrapy.Spider):
             yield scrapy.Request(url=next_page_url, callback=self.parse)
 
     def parse(self, response):
-        for user in range(1, 51):
-            xpathlink = '//*[@id="topicRow' + str(user) + '"]/td[4]/a[1]/text()'
-            username = response.xpath(xpathlink).get()
+        # One XPath over every topic row (topicRow1..topicRow50)
+        usernames = response.xpath('//*[starts-with(@id, "topicRow")]/td[4]/a[1]/text()').getall()
+        for username in usernames:
             
             # 2. Check if we have a username AND if it's not already in our set.
             if username and username not in self.seen_usernames: